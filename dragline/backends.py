@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Watcher backends, each one feeds `Dragline.start` with the same
+# {'added': [...], 'modified': [...], 'removed': [...]} dict that
+# `Dragline.get_changes` produces
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+
+from .events import empty_changes, merge_status
+from .record import Record
+from .gitignore import IGNORE_FILES
+
+
+class Backend(object):
+    def __init__(self, dragline):
+        self.dragline = dragline
+
+    def start(self, record=None):
+        """
+        Build the baseline, called once before the first `poll`.
+
+        `record` is a snapshot from a previous run, if given the tree is diffed
+        against it and the changes made meanwhile are returned
+        """
+        raise NotImplementedError
+
+    def poll(self, timeout):
+        """
+        Wait at most `timeout` seconds, return the changes since last call
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def fileno(self):
+        """
+        A file descriptor that is readable when `poll` has events,
+        None if changes are only found by polling
+        """
+        return None
+
+    def get_record(self):
+        """
+        Return a `Record` of the files currently known
+        """
+        raise NotImplementedError
+
+    def paths(self):
+        """
+        The paths of the files currently known, unlike `get_record` nothing
+        is stat'ed; like `poll` it is called from the monitor loop
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        return len(self.paths())
+
+
+class PollingBackend(Backend):
+    """
+    Walk the whole tree every interval and compare mtimes,
+    works everywhere but costs a full walk on each poll
+    """
+    def start(self, record=None):
+        if record is None:
+            self.dragline.last_record = self.dragline.get_record()
+            return empty_changes()
+
+        self.dragline.last_record = record
+        changes, changes_list = self.dragline.get_changes()
+        return changes
+
+    def get_record(self):
+        return self.dragline.last_record
+
+    def paths(self):
+        return list(self.dragline.last_record or ())
+
+    def __len__(self):
+        return len(self.dragline.last_record or ())
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+
+        changes, changes_list = self.dragline.get_changes()
+        return changes
+
+
+# constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_event_struct = struct.Struct('iIII')
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+def inotify_available():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        libc = _get_libc()
+    except OSError:
+        return False
+    return hasattr(libc, 'inotify_init1')
+
+
+class InotifyBackend(Backend):
+    """
+    Linux inotify backend, one watch per directory that the walk
+    function accepts, so ignore rules are applied the same way as polling
+    """
+    # IN_MODIFY is left out on purpose, it fires on every write(2)
+    # while IN_CLOSE_WRITE fires once the file is complete
+    dir_mask = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+    def start(self, record=None):
+        self.libc = _get_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, 'inotify_init1 failed: %s' % os.strerror(e))
+
+        self.wds = {}  # wd -> dirpath
+        self.dirs = {}  # dirpath -> wd
+        self.files = set()
+        # files created and still open for writing, they are reported as
+        # added once closed rather than empty or half-written
+        self.opened = set()
+        self.pending = {}  # filepath -> status
+        # directories whose ignore files changed in the events being read
+        self.rescans = set()
+
+        self._scan(self.dragline.root, initial=True)
+        logging.debug('inotify watching %s directories, %s files' % (len(self.dirs), len(self.files)))
+
+        if record is None:
+            return empty_changes()
+        return record.update(self._iter_stats())
+
+    def get_record(self):
+        record = Record()
+        record.update(self._iter_stats())
+        return record
+
+    def paths(self):
+        return list(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def _iter_stats(self):
+        for i in self.files:
+            try:
+                mtime, size = self.dragline.get_stat(i)
+            except OSError:
+                continue
+            yield i, mtime, size
+
+    def close(self):
+        if getattr(self, 'fd', None) is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def fileno(self):
+        return self.fd
+
+    def poll(self, timeout):
+        r, w, x = select.select([self.fd], [], [], timeout)
+        if r:
+            self._read_events()
+            if self.rescans:
+                for i in sorted(self.rescans):
+                    self._rescan_dir(i)
+                self.rescans.clear()
+
+        changes = empty_changes()
+        for filepath, status in self.pending.iteritems():
+            changes[status].append(filepath)
+        self.pending = {}
+        return changes
+
+    def _add_watch(self, dirpath):
+        wd = self.libc.inotify_add_watch(self.fd, dirpath, self.dir_mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e == errno.ENOSPC:
+                logging.warning('inotify watch limit reached, see /proc/sys/fs/inotify/max_user_watches')
+            else:
+                logging.debug('inotify_add_watch %s failed: %s' % (dirpath, os.strerror(e)))
+            return
+        self.wds[wd] = dirpath
+        self.dirs[dirpath] = wd
+
+    def _forget_dir(self, dirpath, rm_watch=False):
+        prefix = dirpath + '/'
+        for i in [i for i in self.dirs if i == dirpath or i.startswith(prefix)]:
+            wd = self.dirs.pop(i)
+            self.wds.pop(wd, None)
+            if rm_watch:
+                self.libc.inotify_rm_watch(self.fd, wd)
+        for i in [i for i in self.files if i.startswith(prefix)]:
+            self.files.discard(i)
+            if i in self.opened:
+                self.opened.discard(i)
+            else:
+                self._event(i, 'removed')
+
+    def _scan(self, top, initial=False):
+        """
+        Add watches for `top` and its subdirectories, new files are reported
+        as added unless it is the initial scan
+        """
+        for dirpath, dirnames, filenames, filepaths in self.dragline.walk(top):
+            self._add_watch(os.path.normpath(dirpath))
+            for i in filepaths:
+                if i in self.files:
+                    continue
+                self.files.add(i)
+                if not initial:
+                    self._event(i, 'added')
+
+    def _rescan(self):
+        """
+        The kernel queue overflowed and events were lost, fall back to a walk
+        """
+        logging.warning('inotify event queue overflowed, rescanning')
+        known = self.files
+        self.files = set()
+        self._scan(self.dragline.root, initial=True)
+        for i in self.files - known:
+            self._event(i, 'added')
+        for i in known - self.files:
+            if not i in self.opened:
+                self._event(i, 'removed')
+        self.opened &= self.files
+
+    def _rescan_dir(self, top):
+        """
+        An ignore file in `top` changed, walk it again: watch the directories
+        that are no longer ignored, drop the ones that now are, and report
+        the files that came in or went out as added or removed
+        """
+        if not top in self.dirs:
+            return
+        self.dragline.ignore_rules_changed(top)
+
+        prefix = top + '/'
+
+        def under(path):
+            return top == '.' or path == top or path.startswith(prefix)
+
+        dirs = set()
+        files = set()
+        for dirpath, dirnames, filenames, filepaths in self.dragline.walk(top):
+            dirpath = os.path.normpath(dirpath)
+            dirs.add(dirpath)
+            if not dirpath in self.dirs:
+                self._add_watch(dirpath)
+            files.update(filepaths)
+
+        for i in [i for i in self.dirs if under(i) and not i in dirs]:
+            wd = self.dirs.pop(i)
+            self.wds.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+        for i in files - self.files:
+            self.files.add(i)
+            self._event(i, 'added')
+        for i in [i for i in self.files if under(i) and not i in files]:
+            self.files.discard(i)
+            if i in self.opened:
+                self.opened.discard(i)
+            else:
+                self._event(i, 'removed')
+
+    def _event(self, filepath, status):
+        if filepath in self.pending:
+            status = merge_status(self.pending[filepath], status)
+            if status is None:
+                del self.pending[filepath]
+                return
+        self.pending[filepath] = status
+
+    def _read_events(self):
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not buf:
+                break
+
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = _event_struct.unpack_from(buf, offset)
+                offset += _event_struct.size
+                name = buf[offset:offset + length].rstrip('\0')
+                offset += length
+                self._handle(wd, mask, name)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self._rescan()
+            return
+
+        dirpath = self.wds.get(wd)
+        if dirpath is None:
+            return
+
+        if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF) and not name:
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                if self.dirs.get(dirpath) == wd:
+                    self._forget_dir(dirpath)
+            return
+
+        path = os.path.normpath(os.path.join(dirpath, name))
+
+        if name in IGNORE_FILES and self.dragline.gitignore:
+            self.rescans.add(dirpath)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if self.dragline.recursive and not self.dragline.ignore_dir(dirpath, name):
+                    self._scan(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._forget_dir(path, rm_watch=bool(mask & IN_MOVED_FROM))
+            return
+
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            if path in self.files:
+                self.files.discard(path)
+                if path in self.opened:
+                    # never reported
+                    self.opened.discard(path)
+                else:
+                    self._event(path, 'removed')
+        elif mask & IN_CREATE:
+            if not path in self.files and self.dragline.check_file(path):
+                self.files.add(path)
+                if os.path.islink(path):
+                    # no close follows the creation of a link
+                    self._event(path, 'added')
+                else:
+                    self.opened.add(path)
+        elif mask & (IN_MOVED_TO | IN_CLOSE_WRITE | IN_ATTRIB):
+            if path in self.opened:
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.opened.discard(path)
+                    self._event(path, 'added')
+            elif path in self.files:
+                self._event(path, 'modified')
+            elif self.dragline.check_file(path):
+                self.files.add(path)
+                self._event(path, 'added')
+
+
+_backends = {
+    'polling': PollingBackend,
+    'inotify': InotifyBackend,
+}
+
+
+def get_backend(name):
+    """
+    `name` is one of 'auto', 'polling', 'inotify',
+    'auto' picks inotify when it is available
+    """
+    if name == 'auto':
+        if inotify_available():
+            name = 'inotify'
+        else:
+            name = 'polling'
+    if not name in _backends:
+        raise Exception('Backend should be one of auto, %s' % ', '.join(_backends))
+    logging.debug('using %s backend' % name)
+    return _backends[name]
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Benchmarks for dragline's hot paths, run with:
+#
+#     dragline bench [--files N] [--depth N] [--ignore-ratio R] [--churn R] [--backend NAME]
+#
+# A synthetic tree is generated in a temp dir, the walk, record, diff, matching
+# and dispatch are timed on it, and the results are printed as JSON so that
+# runs of different versions or backends could be compared.
+#
+#     python -m dragline.bench --record [entries ...]
+#
+# prints the record store against the dict it replaced, the KiB columns are
+# the memory allocated by one poll.
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import random
+import tempfile
+import itertools
+
+from .record import Record
+
+
+def legacy_get_record(stats):
+    record = {}
+    for filepath, mtime, size in stats:
+        record[filepath] = mtime
+    return record
+
+
+def legacy_get_changes(last_record, record):
+    """
+    `Dragline.get_changes` before the record store
+    """
+    changes = {
+        'added': [],
+        'modified': [],
+        'removed': []
+    }
+    for filepath, mtime in record.iteritems():
+        if filepath in last_record:
+            if mtime != last_record[filepath]:
+                changes['modified'].append(filepath)
+        else:
+            changes['added'].append(filepath)
+    changes['removed'] = [i for i in last_record if not i in record]
+
+    return changes, list(itertools.chain(*changes.itervalues()))
+
+
+def synthetic_stats(n, churn=0.01, seed=0):
+    """
+    Return two lists of (path, mtime, size), the second one has `churn` of
+    the entries modified, added or removed
+    """
+    rnd = random.Random(seed)
+    base = [('dir%d/sub%d/file%d.styl' % (i % 100, i % 7, i), 1000000.0 + i, i % 4096)
+            for i in xrange(n)]
+    current = list(base)
+    count = int(n * churn) // 3
+    for i in rnd.sample(xrange(n), count * 2)[:count]:
+        path, mtime, size = current[i]
+        current[i] = (path, mtime + 1, size)
+    del current[-count:]
+    current.extend(('new/file%d.styl' % i, 2000000.0, 0) for i in xrange(count))
+    return base, current
+
+
+def _changes_bytes(changes):
+    return sum(sys.getsizeof(i) for i in changes.itervalues())
+
+
+def _timeit(func, *args):
+    gc.collect()
+    t0 = time.time()
+    rv = func(*args)
+    return time.time() - t0, rv
+
+
+def bench_record(n, churn=0.01):
+    base, current = synthetic_stats(n, churn)
+
+    legacy_last = legacy_get_record(base)
+    t_legacy, legacy_current = _timeit(legacy_get_record, current)
+    t, rv = _timeit(legacy_get_changes, legacy_last, legacy_current)
+    t_legacy += t
+    legacy_count = len(rv[1])
+    # a fresh dict and a float object per file on every poll
+    legacy_bytes = (sys.getsizeof(legacy_current) + len(legacy_current) * sys.getsizeof(1.0) +
+                    _changes_bytes(rv[0]))
+
+    record = Record()
+    record.update(base)
+    t_record, rv = _timeit(record.update, current)
+    record_count = sum(len(i) for i in rv.itervalues())
+    record_bytes = _changes_bytes(rv)
+
+    assert legacy_count == record_count, (legacy_count, record_count)
+    return {
+        'entries': n,
+        'changes': record_count,
+        'legacy_seconds': t_legacy,
+        'record_seconds': t_record,
+        'legacy_poll_bytes': legacy_bytes,
+        'record_poll_bytes': record_bytes,
+    }
+
+
+def make_tree(root, files, depth=3, ignore_ratio=0.1, seed=0):
+    """
+    Create `files` empty files under `root`, spread over directories `depth`
+    levels deep, `ignore_ratio` of them are *.log files that the benchmark
+    config ignores. Return the relative paths of the files that are watched
+    """
+    rnd = random.Random(seed)
+    fanout = max(2, int(round((files / 10.0) ** (1.0 / max(depth, 1)))))
+    dirs = set()
+    watched = []
+    for i in xrange(files):
+        parts = ['d%d' % rnd.randrange(fanout) for level in xrange(depth)]
+        dirpath = '/'.join(parts)
+        if rnd.random() < ignore_ratio:
+            filepath = '%s/file%d.log' % (dirpath, i)
+        else:
+            filepath = '%s/file%d.%s' % (dirpath, i, rnd.choice(('styl', 'jade', 'js')))
+            watched.append(filepath)
+        if not dirpath in dirs:
+            os.makedirs(os.path.join(root, dirpath))
+            dirs.add(dirpath)
+        open(os.path.join(root, filepath), 'w').close()
+    return watched
+
+
+def churn_tree(watched, churn=0.01, seed=1):
+    """
+    Modify, add and remove `churn` of the watched files in the current
+    directory, in equal parts, return the number of changes made
+    """
+    rnd = random.Random(seed)
+    count = int(len(watched) * churn) // 3
+    picked = rnd.sample(watched, count * 2)
+    # step past the mtime resolution of the file system
+    mtime = time.time() + 10
+    for filepath in picked[:count]:
+        os.utime(filepath, (mtime, mtime))
+    for filepath in picked[count:]:
+        os.remove(filepath)
+    for i in xrange(count):
+        open('%s/new%d.styl' % (os.path.dirname(picked[i]), i), 'w').close()
+    return count * 3
+
+
+def _noop(dirpath, filename, filepath):
+    pass
+
+
+def bench_tree(files=10000, depth=3, ignore_ratio=0.1, churn=0.01, backend='polling',
+               scanner='full'):
+    """
+    Time the hot paths of `Dragline` on a synthetic tree, with no-op handlers
+    """
+    from .core import Dragline
+    from .backends import get_backend
+
+    root = tempfile.mkdtemp(prefix='dragline-bench-')
+    cwd = os.getcwd()
+    try:
+        watched = make_tree(root, files, depth, ignore_ratio)
+        os.chdir(root)
+
+        # handlers run inline, so that `execute` times them rather than
+        # the enqueueing, and nothing runs on a worker during later timings
+        drag = Dragline(ignores=['*.log'], handlers=[('*.styl', _noop), ('*.jade', _noop)],
+                        scanner=scanner, workers=0)
+        rv = {
+            'files': files,
+            'watched': len(watched),
+            'depth': depth,
+            'ignore_ratio': ignore_ratio,
+            'churn': churn,
+            'backend': backend,
+            'scanner': scanner,
+        }
+
+        def walk():
+            for i in drag.walk():
+                pass
+
+        rv['walk'], _ = _timeit(walk)
+        rv['get_record'], drag.last_record = _timeit(drag.get_record)
+        rv['get_changes_unchanged'], _ = _timeit(drag.get_changes)
+
+        def match():
+            for i in watched:
+                drag.ignore_file(i)
+                drag.get_handler(i)
+
+        rv['match'], _ = _timeit(match)
+        rv['match_per_file'] = rv['match'] / max(len(watched), 1)
+
+        changes = {'added': [], 'modified': watched, 'removed': []}
+        rv['execute'], _ = _timeit(drag._execute, changes)
+        rv['execute_per_file'] = rv['execute'] / max(len(watched), 1)
+
+        rv['changes'] = churn_tree(watched, churn)
+        t, (changes, changes_list) = _timeit(drag.get_changes)
+        rv['get_changes'] = t
+        rv['get_changes_found'] = len(changes_list)
+
+        # detection through the backend, from the change to `poll` reporting it
+        watched = [i for i in watched if os.path.exists(i)]
+        os.utime(watched[-1], None)
+        drag.last_record = None
+        watcher = get_backend(backend)(drag)
+        t0 = time.time()
+        watcher.start()
+        rv['backend_start'] = time.time() - t0
+        try:
+            churn_tree(watched, churn, seed=2)
+            t0 = time.time()
+            found = 0
+            while found < rv['changes'] and time.time() - t0 < 5:
+                found += sum(len(i) for i in watcher.poll(0.01).itervalues())
+            rv['backend_poll'] = time.time() - t0
+            rv['backend_found'] = found
+        finally:
+            watcher.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    return rv
+
+
+def main(argv=None):
+    import argparse
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(prog='dragline bench',
+                                     description='Benchmark dragline on a synthetic tree')
+    parser.add_argument('--files', type=int, default=10000, help='number of files')
+    parser.add_argument('--depth', type=int, default=3, help='directory depth')
+    parser.add_argument('--ignore-ratio', type=float, default=0.1,
+                        help='ratio of files that are ignored')
+    parser.add_argument('--churn', type=float, default=0.01,
+                        help='ratio of watched files changed between two polls')
+    parser.add_argument('--backend', default='polling', help='auto, polling or inotify')
+    parser.add_argument('--scanner', default='full', help='full or incremental')
+    parser.add_argument('--record', type=int, nargs='*', metavar='entries',
+                        help='compare the record store with the legacy dict instead')
+    args = parser.parse_args(argv)
+
+    if args.record is not None:
+        print_record_table(args.record or [10000, 100000, 1000000])
+        return
+
+    rv = bench_tree(args.files, args.depth, args.ignore_ratio, args.churn,
+                    args.backend, args.scanner)
+    print json.dumps(rv, indent=2, sort_keys=True)
+
+
+def print_record_table(sizes):
+    print '%10s %10s %12s %12s %14s %14s' % (
+        'entries', 'changes', 'legacy(s)', 'record(s)', 'legacy(KiB)', 'record(KiB)')
+    for n in sizes:
+        rv = bench_record(n)
+        print '%10d %10d %12.4f %12.4f %14d %14d' % (
+            rv['entries'], rv['changes'], rv['legacy_seconds'], rv['record_seconds'],
+            rv['legacy_poll_bytes'] // 1024, rv['record_poll_bytes'] // 1024)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class BuildCache(object):
+    """
+    Compiled outputs keyed on what produced them, least recently used
+    entries are evicted once the outputs take more than `max_bytes`.
+    It is shared by the handlers of a process, which may run on several threads
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self.lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                k, v = self._entries.popitem(last=False)
+                self.size -= len(v)
+
+
+def make_key(*parts):
+    """
+    Digest of `parts`, each one should have a stable repr
+    """
+    h = hashlib.sha1()
+    for i in parts:
+        if isinstance(i, unicode):
+            i = i.encode('utf8')
+        elif not isinstance(i, str):
+            i = repr(i)
+        h.update(i)
+        h.update('\0')
+    return h.hexdigest()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A small HTTP API to a running dragline, served over a unix socket or on
+# localhost from a thread next to the monitor loop:
+#
+#     GET  /status                          paused, files known, queue depth
+#     GET  /metrics                         `Dragline.metrics()`
+#     GET  /events                          change events as JSON lines, until the client leaves
+#     POST /trigger?action=^&pattern=*.styl  handle the matching known files
+#     POST /pause, POST /resume              hold changes, handle the held ones
+#
+# e.g. `curl --unix-socket .dragline/control.sock -X POST 'http://-/trigger?pattern=*.styl'`
+#
+# Commands are carried out by the monitor loop, which they wake up through a
+# pipe, so they share its in-memory record without waiting for its next poll.
+
+import os
+import json
+import fcntl
+import errno
+import Queue
+import socket
+import logging
+import urlparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+
+class ControlHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # events are streamed until the connection is closed
+    protocol_version = 'HTTP/1.0'
+
+    def address_string(self):
+        # no client address on a unix socket
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        logging.debug('control: ' + format % args)
+
+    def do_GET(self):
+        path, query = self._parse()
+        control = self.server.control
+        if path == '/status':
+            # from the loop, which is the one that changes what it reports
+            self._reply_result(control.call('status'))
+        elif path == '/metrics':
+            self._reply(200, control.dragline.metrics())
+        elif path == '/events':
+            self._stream(control)
+        else:
+            self._reply(404, {'error': 'unknown path %s' % path})
+
+    def do_POST(self):
+        path, query = self._parse()
+        control = self.server.control
+        if path == '/trigger':
+            action = query.get('action', '^')
+            pattern = query.get('pattern', 'all')
+            rv = control.call('trigger', action, pattern)
+        elif path == '/pause':
+            rv = control.call('pause')
+        elif path == '/resume':
+            rv = control.call('resume')
+        else:
+            self._reply(404, {'error': 'unknown path %s' % path})
+            return
+        self._reply_result(rv)
+
+    def _parse(self):
+        url = urlparse.urlparse(self.path)
+        query = dict((k, v[-1]) for k, v in urlparse.parse_qs(url.query).iteritems())
+        return url.path, query
+
+    def _reply_result(self, rv):
+        if isinstance(rv, Exception):
+            self._reply(400, {'error': str(rv)})
+        else:
+            self._reply(200, rv)
+
+    def _reply(self, code, data):
+        body = json.dumps(data) + '\n'
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, control):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        q = control.subscribe()
+        try:
+            while not control.closed:
+                try:
+                    event = q.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                self.wfile.write(json.dumps(event) + '\n')
+                self.wfile.flush()
+        except (IOError, socket.error):
+            pass
+        finally:
+            control.unsubscribe(q)
+
+
+class TCPControlServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixControlServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def parse_address(address):
+    """
+    'unix:path' or 'host:port', a bare port is on localhost
+    """
+    if isinstance(address, int):
+        return 'tcp', ('127.0.0.1', address)
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    host, sep, port = address.rpartition(':')
+    return 'tcp', (host or '127.0.0.1', int(port))
+
+
+class ControlServer(object):
+    """
+    Serve `ControlHandler` from a thread, and queue the commands it gets
+    for the monitor loop, which runs them with `process`
+    """
+    def __init__(self, dragline, address):
+        self.dragline = dragline
+        self.address = address
+        self.commands = Queue.Queue()
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+        kind, addr = parse_address(address)
+        if kind == 'unix':
+            dirpath = os.path.dirname(addr)
+            if dirpath and not os.path.exists(dirpath):
+                os.makedirs(dirpath)
+            if os.path.exists(addr):
+                os.remove(addr)
+            self.server = UnixControlServer(addr, ControlHandler)
+        else:
+            self.server = TCPControlServer(addr, ControlHandler)
+        self.server.control = self
+        self.unix_path = addr if kind == 'unix' else None
+
+        self.thread = threading.Thread(target=self.server.serve_forever, name='dragline-control')
+        self.thread.daemon = True
+
+        # `call` writes to it so that the loop waiting on `fileno` wakes up
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    def start(self):
+        self.thread.start()
+        logging.info('control endpoint listening on %s' % self.address)
+
+    def close(self):
+        self.closed = True
+        self.server.shutdown()
+        self.server.server_close()
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.remove(self.unix_path)
+        # release the requests still waiting for the loop
+        while True:
+            try:
+                name, args, reply = self.commands.get_nowait()
+            except Queue.Empty:
+                break
+            reply.put(Exception('dragline stopped'))
+        with self.lock:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    def fileno(self):
+        """
+        Readable when commands are waiting for `process`
+        """
+        return self._wake_r
+
+    def _wake(self):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                os.write(self._wake_w, 'x')
+            except OSError, e:
+                # a full pipe wakes the loop up already
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def call(self, name, *args):
+        """
+        Queue a command for the monitor loop and wait for its result
+        """
+        reply = Queue.Queue(1)
+        self.commands.put((name, args, reply))
+        self._wake()
+        while not self.closed:
+            try:
+                return reply.get(timeout=1)
+            except Queue.Empty:
+                continue
+        return Exception('dragline stopped')
+
+    def process(self):
+        """
+        Run the queued commands, called by the monitor loop
+        """
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        while True:
+            try:
+                name, args, reply = self.commands.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                rv = getattr(self.dragline, 'control_' + name)(*args)
+            except Exception, e:
+                logging.warning('control command %s failed: %s' % (name, e))
+                rv = e
+            reply.put(rv)
+
+    def subscribe(self):
+        q = Queue.Queue(10000)
+        with self.lock:
+            self.subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            if q in self.subscribers:
+                self.subscribers.remove(q)
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except Queue.Full:
+                # a client that does not read loses events rather than
+                # holding up the loop
+                pass
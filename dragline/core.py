@@ -6,14 +6,33 @@
 #   * scaning bar
 
 import os
+import re
 import sys
+import imp
 import time
+import errno
+import select
 import fnmatch
 import logging
 import itertools
 import inspect
+import signal
+import threading
+from collections import deque
 
 from .handlers import run_command_str
+from .backends import get_backend
+from .scanner import IncrementalScanner, list_dir
+from .record import Record
+from .matcher import PatternMatcher, AllowList, literal_prefix
+from .pool import HandlerPool
+from .events import Coalescer, empty_changes
+from .digest import DigestCache
+from .snapshot import save_record, load_record
+from .metrics import Stats, Profiler
+from .depgraph import DependencyGraph
+from .control import ControlServer
+from .gitignore import GitIgnore
 
 
 logging.basicConfig(format='- %(message)s', level=logging.INFO)
@@ -36,15 +55,32 @@ TRIGGER_FLAG = {
     '-': 'removed'
 }
 
+# where dragline keeps its state in the project directory
+STATE_DIR = '.dragline'
+
+SNAPSHOT_PATH = os.path.join(STATE_DIR, 'snapshot')
+
+DEPS_PATH = os.path.join(STATE_DIR, 'deps')
+
+DIGESTS_PATH = os.path.join(STATE_DIR, 'digests')
+
+# seconds over which changes are counted against `burst`
+BURST_WINDOW = 1.0
+
 get_mtime = lambda x: os.stat(x).st_mtime
 
+
+def get_stat(filepath):
+    st = os.stat(filepath)
+    return st.st_mtime, st.st_size
+
 # `_dir_ignores` overlooks relative path
 # and only matches the name of directory
 # so .git/ ignore any directory named '.git',
 # if you want's to only ignore some/where/.git/,
 # remove '.git/' in `_dir_ignores`
 # and add 'some/where/.git/' in dragconfig.IGNORES
-_dir_ignores = set(['.git', '.hg', '.svn'])
+_dir_ignores = set(['.git', '.hg', '.svn', '.dragline'])
 
 _ext_ignores = set(['*.pyc', '.pyo', '.swp', '.swo', '.o'])
 
@@ -56,7 +92,11 @@ class EmptyClass(object):
 class Dragline(object):
 
     def __init__(self, ignores=[], watches=[], handlers=[], global_handler=None,
-                 interval=300, recursive=True, debug=False):
+                 interval=300, recursive=True, debug=False, backend='auto',
+                 scanner='full', restat_batch=0, workers=1, debounce=0,
+                 checksum=False, snapshot=False, prewarm=False, stats_interval=0,
+                 profile=False, control=None, supersede='queue', root='.', pool=None,
+                 gitignore=False, burst=50):
         """
         possible keywork arguments:
             None
@@ -78,25 +118,150 @@ class Dragline(object):
             handlers
                 monitor files that matches watches,
                 call function for each watch rules
+
+        `backend` chooses how changes are detected, 'inotify' is event driven,
+        'polling' walks the tree every `interval` ms, 'auto' picks inotify
+        when the platform supports it
+
+        `scanner` chooses how the tree is walked, 'full' lists every directory
+        and stats every file on each walk, 'incremental' only lists directories
+        whose mtime changed, and stats `restat_batch` of the unchanged files per
+        walk in rotation (0 means all of them)
+
+        `workers` is the number of handlers that could run at the same time,
+        changes of one file are always handled in order. Handlers run on worker
+        threads, so changes are still detected while they run, 0 runs them in
+        the monitor loop instead
+
+        `debounce` is a quiet window in ms, changes are held until no new
+        change came in for that long, and repeated events of a file are
+        collapsed into one
+
+        `checksum` drops modified events of files whose content is the same as
+        the last time they were seen, e.g. after `touch` or a branch switch
+        that rewrites identical files; a file is hashed only when its
+        inode, size or mtime changed. With `snapshot` the digests are kept
+        in .dragline/digests, and the files are hashed once at start
+
+        `snapshot` keeps the record in .dragline/snapshot between runs, so
+        changes made while dragline was not running are handled at start
+
+        `prewarm` creates the compilers of compile handlers at start
+        instead of on their first event
+
+        `stats_interval` logs a summary of the timings and counters every that
+        many seconds, 0 means only when dragline stops
+
+        `profile` runs the monitor loop under cProfile, the profile is written
+        to .dragline/ when dragline stops; SIGUSR1 switches profiling on and off
+        at runtime
+
+        `control` is an address to serve the control API on, 'unix:path' for
+        a unix socket or 'host:port', see dragline.control
+
+        `supersede` is what happens when a file changes again while its handler
+        is still waiting or running: 'queue' handles it again afterwards,
+        'cancel' kills the commands of the running handler, discards their
+        output and handles the newest change right away, 'ignore' drops the
+        newer change
+
+        `root` is the directory to watch, patterns are relative to it while the
+        paths given to handlers are relative to the working directory
+
+        `pool` is a `HandlerPool` shared with other instances, `workers` is
+        ignored if it is given
+
+        `gitignore` also ignores what the .gitignore and .draglineignore files
+        under the root ignore, ignored directories are not walked; when one
+        of these files changes, the directory it is in is walked again
+
+        `burst` is the number of changes in BURST_WINDOW seconds from which
+        they are handled as bulk, e.g. a checkout that the watcher reports over
+        several polls, after the changes that come in once it is over, so that
+        the file being edited is not queued behind it; the `priority` of a
+        handler class goes first, and its `concurrency` caps how many of it
+        run at the same time
         """
         # check kwargs
         assert not (ignores and watches), 'ignores and watches could not both exist'
 
         # assign values
         # NOTE is it nessessary to check whether path is legal or not ?
+        self.root = os.path.normpath(root)
+        if self.root == '.':
+            self._prefix = ''
+        else:
+            self._prefix = self.root + '/'
         self.ignores = ignores
         self.watches = watches
+        self.gitignore = gitignore
         #self.watches_handlers = watches_handlers
         self.handlers = handlers
+        self.handler_matcher = PatternMatcher([i[0] for i in handlers])
         self.global_handler = global_handler
         self.interval = interval
         self.recursive = recursive
         self.debug = debug
+        self.backend = backend
+        self.scanner = scanner
+        self.restat_batch = restat_batch
+        self.workers = workers
+        self.supersede = supersede
+        self.burst = burst
+        # (time, number of changes) of the change sets in the burst window
+        self._recent = deque()
+        self._recent_count = 0
+        self.debounce = debounce
+        self.checksum = checksum
+        self.snapshot = snapshot
+        self.prewarm = prewarm
+        self.stats_interval = stats_interval
+        self.profile = profile
+        self.stats = Stats()
+        self.profiler = Profiler(self._prefix + STATE_DIR)
+        self._profile_toggled = False
+        self.control = control
+        self.control_server = None
+        self.paused = False
+        self._held = Coalescer(0)
+        self.depgraph = DependencyGraph()
+        self.depgraph.load(self._prefix + DEPS_PATH)
         self.dragline_record = {}
 
+        if checksum:
+            self.digests = DigestCache()
+        else:
+            self.digests = None
+
+        if debounce:
+            self.coalescer = Coalescer(float(debounce) / 1000)
+        else:
+            self.coalescer = None
+
+        if pool is not None:
+            self.pool = pool
+        elif workers > 0:
+            self.pool = HandlerPool(workers, supersede=supersede)
+        else:
+            self.pool = None
+        self.watcher = None
+        # (cmd, Popen) of commands that nothing waits for
+        self.children = []
+        self._global_cond = threading.Condition()
+        self._global_pending = False
+        self._global_thread = None
+
         # make walk function
         self._make_walk_func()
 
+    def relpath(self, path):
+        """
+        `path` relative to the root
+        """
+        if self._prefix and path.startswith(self._prefix):
+            return path[len(self._prefix):]
+        return path
+
     def log_changes(self, changes):
         log = 'Changes:\n'
         for t, l in changes.iteritems():
@@ -106,34 +271,143 @@ class Dragline(object):
 
         logging.debug(log)
 
-    def get_record(self, pattern=None):
-        record = {}
+    def iter_stats(self, pattern=None):
+        """
+        Walk the tree, yield (filepath, mtime, size) for each file
+        """
+        t0 = time.time()
+        n = 0
         for dirpath, dirnames, filenames, filepaths in self.walk():
-            logging.debug('self.walk: %s, %s, %s, %s' % (dirpath, dirnames, filenames, filepaths))
+            logging.debug('self.walk: %s, %s, %s, %s', dirpath, dirnames, filenames, filepaths)
             for i in filepaths:
-                if pattern and not fnmatch.fnmatch(i, pattern):
+                if pattern and not fnmatch.fnmatch(self.relpath(i), pattern):
                     continue
-                record[i] = get_mtime(i)
+                mtime, size = self.get_stat(i)
+                n += 1
+                yield i, mtime, size
+        self.stats.add('walk', time.time() - t0)
+        self.stats.incr('files.stat', n)
+
+    def get_record(self, pattern=None):
+        record = Record()
+        record.update(self.iter_stats(pattern))
         return record
 
-    def get_changes(self, record):
-        changes = {
-            'added': [],
-            'modified': [],
-            'removed': []
-        }
-        for filepath, mtime in record.iteritems():
-            if filepath in self.last_record:
-                if mtime != self.last_record[filepath]:
-                    changes['modified'].append(filepath)
-            else:
-                changes['added'].append(filepath)
-        changes['removed'] = [i for i in self.last_record if not i in record]
+    def get_changes(self):
+        """
+        Walk the tree and diff it against `last_record` in place
+        """
+        if self._gitignore and self._scanner:
+            # the listings cached under a changed ignore file are out of date,
+            # editing the file does not change the mtime of its directory
+            for i in self._gitignore.changed_dirs():
+                self._scanner.invalidate(i)
+        changes = self.last_record.update(self.iter_stats())
 
         return changes, list(itertools.chain(*changes.itervalues()))
 
+    def ignore_rules_changed(self, dirpath):
+        """
+        Called by the watcher when an ignore file in `dirpath` changed, the
+        rules are read again and what is under it is listed again
+        """
+        if self._gitignore:
+            self._gitignore.forget(dirpath)
+        if self._scanner:
+            self._scanner.invalidate(dirpath)
+
+    def drop_unchanged(self, changes):
+        """
+        Drop modified files whose content digest did not change, the digests of
+        added files are taken so that their next modification can be compared
+        """
+        changes['modified'] = [i for i in changes['modified'] if self.digests.changed(i)]
+        for i in changes['added']:
+            self.digests.changed(i)
+        for i in changes['removed']:
+            self.digests.forget(i)
+        return changes
+
+    def report_exit(self, cmd, returncode):
+        """
+        Called by command handlers with the exit code of each command they run
+        """
+        self.stats.incr('exit.%s' % returncode)
+
+    def metrics(self):
+        """
+        The timings and counters so far, see `Stats.get` for the fields of a timing
+        """
+        return {
+            'timings': self.stats.summary(),
+            'counters': self.stats.get_counters(),
+        }
+
+    def report_dependencies(self, source, deps):
+        """
+        Called by handlers with the files that building `source` read
+        """
+        self.depgraph.set_dependencies(source, deps)
+
+    def add_dependents(self, changes):
+        """
+        Add the files that depend on the changed ones as modified
+        """
+        if not len(self.depgraph):
+            return changes
+        changed = set(itertools.chain(*changes.itervalues()))
+        dependents = set()
+        for i in changed:
+            dependents.update(self.depgraph.get_dependents(i))
+        for i in changes['removed']:
+            self.depgraph.remove(i)
+        dependents = sorted(i for i in dependents - changed if os.path.isfile(i))
+        if dependents:
+            logging.debug('dependents of changes: %s' % dependents)
+            changes['modified'] = list(changes['modified']) + dependents
+        return changes
+
+    def save_dependencies(self):
+        if not self.depgraph.dirty:
+            return
+        try:
+            self.depgraph.save(self._prefix + DEPS_PATH)
+        except (OSError, IOError), e:
+            logging.warning('failed to save dependencies: %s' % e)
+
+    def save_snapshot(self):
+        if not self.snapshot:
+            return
+        try:
+            save_record(self.watcher.get_record(), self._prefix + SNAPSHOT_PATH)
+            if self.digests:
+                self.digests.save(self._prefix + DIGESTS_PATH)
+        except (OSError, IOError), e:
+            logging.warning('failed to save snapshot: %s' % e)
+
+    def load_snapshot(self):
+        if not self.snapshot:
+            return None
+        if self.digests:
+            self.digests.load(self._prefix + DIGESTS_PATH)
+        return load_record(self._prefix + SNAPSHOT_PATH)
+
+    def seed_digests(self):
+        """
+        With a snapshot, take the digests of the files that have none, once,
+        so that a touch or a branch switch after a restart is compared too
+        """
+        if not (self.digests and self.snapshot):
+            return
+        t0 = time.time()
+        count = self.digests.seed(self.watcher.paths())
+        if count:
+            logging.info('digests of %s files taken in %.2fs' % (count, time.time() - t0))
+
     def reload_dragline(self):
         print 'dragline package files changed, reload the process..\n'
+        self.save_dependencies()
+        self.save_snapshot()
         os.execv(sys.executable, [sys.executable] + sys.argv)
         sys.exit(0)
 
@@ -154,36 +428,350 @@ class Dragline(object):
         """
         Start monitoring
         """
-        self.last_record = self.get_record()
-
+        try:
+            self.setup()
+            self._loop()
+        except KeyboardInterrupt:
+            print 'dragline interrupted, waiting for running handlers..'
+        finally:
+            self.stop()
+
+    def setup(self):
+        """
+        Start the watcher, and handle the changes made while dragline was not running
+        """
+        if self.prewarm:
+            self.warm_handlers()
+
+        if self.profile:
+            self.profiler.start()
+        signal.signal(signal.SIGUSR1, self._toggle_profile)
+        if self.control:
+            self.control_server = ControlServer(self, self.control)
+            self.control_server.start()
+
+        self.watcher = get_backend(self.backend)(self)
+        changes = self.watcher.start(self.load_snapshot())
+        self._next_poll = time.time() + float(self.interval) / 1000
+        self._last_summary = time.time()
+
+        if any(changes.itervalues()):
+            logging.info('handle changes made while dragline was not running')
+            self._handle(changes, time.time())
+        self.seed_digests()
+
+    def stop(self):
+        if self.pool:
+            self.pool.shutdown()
+        self.save_dependencies()
+        if self.watcher is None:
+            return
+        self.save_snapshot()
+        self.watcher.close()
+        self.reap_children()
+        if self.control_server:
+            self.control_server.close()
+        self.profiler.stop()
+        self.log_stats()
+
+    def log_stats(self):
+        if self.stats.timings or self.stats.counters:
+            logging.info('Stats:\n%s' % self.stats.format())
+
+    def _toggle_profile(self, signum, frame):
+        # switched in the loop, so that the loop rather than the handler is profiled
+        self._profile_toggled = True
+
+    def warm_handlers(self):
+        for pattern, hdr in self.handlers:
+            if inspect.isclass(hdr) and hasattr(hdr, 'warm'):
+                t0 = time.time()
+                hdr.warm()
+                self.stats.add('warm.%s' % hdr.__name__, time.time() - t0)
+
+    def _loop(self):
         while True:
-            record = self.get_record()
+            wait_for([self], self.wait_time())
+            self.tick()
 
-            changes, changes_list = self.get_changes(record)
-            logging.debug('changes: %s; changes_list: %s' % (changes, changes_list))
-
-            if changes_list:
-                self.log_changes(changes)
-
-                if not self._execute is None:
-                    logging.debug('Act on changes')
-                    self._execute(changes)
-            else:
-                logging.debug('no changes')
+    def filenos(self):
+        """
+        The file descriptors that `tick` has something to do for when readable
+        """
+        rv = []
+        if self.watcher.fileno() is not None:
+            rv.append(self.watcher.fileno())
+        if self.control_server:
+            rv.append(self.control_server.fileno())
+        return rv
+
+    def wait_time(self):
+        """
+        Seconds until `tick` has something to do, unless the watcher gets events
+        """
+        if self.watcher.fileno() is None:
+            timeout = self._next_poll - time.time()
+        else:
+            timeout = float(self.interval) / 1000
+        if self.coalescer:
+            remaining = self.coalescer.remaining()
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+        return max(timeout, 0)
+
+    def tick(self):
+        """
+        One turn of the monitor loop, polls the watcher if it is due
+        and handles the changes
+        """
+        if self._profile_toggled:
+            self._profile_toggled = False
+            self.profiler.toggle()
+        if self.control_server:
+            self.control_server.process()
+        if self.children:
+            self.reap_children()
+        if self.stats_interval and time.time() - self._last_summary >= self.stats_interval:
+            self._last_summary = time.time()
+            self.log_stats()
+
+        changes = None
+        if self.watcher.fileno() is not None:
+            changes = self.watcher.poll(0)
+        elif time.time() >= self._next_poll:
+            self._next_poll = time.time() + float(self.interval) / 1000
+            changes = self.watcher.poll(0)
+
+        if self.coalescer:
+            if changes:
+                self.coalescer.feed(changes)
+            if not self.coalescer.ready():
+                return
+            changes = self.coalescer.flush()
+        if changes is not None:
+            self._handle(changes, time.time())
+
+    def _handle(self, changes, detected=None):
+        """
+        `detected` is when the changes were reported, the time from it to the
+        start of each handler is recorded as the dispatch latency
+        """
+        if self.paused:
+            self._held.feed(changes)
+            return
+        if self.digests:
+            changes = self.drop_unchanged(changes)
+        changes = self.add_dependents(changes)
+        changes_list = list(itertools.chain(*changes.itervalues()))
+        logging.debug('changes: %s; changes_list: %s' % (changes, changes_list))
+
+        if changes_list:
+            self.log_changes(changes)
+            self._publish(changes)
+            for status, filepaths in changes.iteritems():
+                if filepaths:
+                    self.stats.incr('changes.%s' % status, len(filepaths))
+
+            if not self._execute is None:
+                logging.debug('Act on changes')
+                self._execute(changes, detected)
+        else:
+            logging.debug('no changes')
 
-            self.last_record = record
+    def _publish(self, changes, trigger=False):
+        if not self.control_server:
+            return
+        now = time.time()
+        for status, filepaths in changes.iteritems():
+            for i in filepaths:
+                self.control_server.publish({
+                    'time': now,
+                    'status': status,
+                    'path': i,
+                    'trigger': trigger,
+                })
+
+    def status(self):
+        if self.pool:
+            queue = self.pool.depth()
+        else:
+            queue = {'pending': 0, 'running': 0, 'groups': {}}
+        watcher = getattr(self, 'watcher', None)
+        return {
+            'pid': os.getpid(),
+            'paused': self.paused,
+            'held': len(self._held.pending),
+            'files': len(watcher) if watcher is not None else 0,
+            'backend': type(watcher).__name__ if watcher is not None else None,
+            'queue': queue,
+        }
 
-            time.sleep(float(self.interval) / 1000)
+    def control_trigger(self, action, pattern):
+        """
+        Like `trigger`, but over the files already in the record, no walk
+        """
+        if not action in TRIGGER_FLAG:
+            raise Exception('action should be one of %s' % ', '.join(TRIGGER_FLAG))
+        status = TRIGGER_FLAG[action]
+        filepaths = self.watcher.paths()
+        if pattern != 'all':
+            matcher = PatternMatcher([pattern], cache_limit=0)
+            filepaths = [i for i in filepaths if matcher.matches(self.relpath(i))]
+        changes = empty_changes()
+        changes[status] = filepaths
+        changes = self.add_dependents(changes)
+        self._publish(changes, trigger=True)
+        self._execute(changes, time.time())
+        return {'triggered': sum(len(i) for i in changes.itervalues())}
+
+    def control_status(self):
+        return self.status()
+
+    def control_pause(self):
+        self.paused = True
+        return self.status()
+
+    def control_resume(self):
+        self.paused = False
+        changes = self._held.flush()
+        if any(changes.itervalues()):
+            self._handle(changes, time.time())
+        return self.status()
+
+    def trigger(self, action, pattern, jobs=None):
+        """
+        Run the handlers of the files that match `pattern` as if they were
+        added, modified or removed. Files are dispatched while the tree is
+        walked, and only the directories under the literal prefix of `pattern`
+        are walked.
 
-    def trigger(self, action, pattern):
+        `jobs` overrides the number of workers
+        """
+        status = TRIGGER_FLAG[action]
         if pattern == 'all':
             pattern = None
-        self._execute({TRIGGER_FLAG[action]: self.get_record(pattern)})
+        if jobs is not None:
+            if self.pool:
+                self.pool.shutdown()
+            if jobs > 1:
+                self.pool = HandlerPool(jobs)
+            else:
+                self.pool = None
+        if self.pool:
+            # keep the walk just ahead of the handlers
+            self.pool.max_pending = self.pool.workers * 4
+
+        t0 = time.time()
+        last_report = t0
+        counts = {
+            'dispatched': 0,
+            'unhandled': 0
+        }
+        # only needed to not dispatch a dependent twice
+        if len(self.depgraph):
+            dispatched = set()
+        else:
+            dispatched = None
+        batches = {}
+
+        def dispatch(filepath, status):
+            if dispatched is not None:
+                if filepath in dispatched:
+                    return
+                dispatched.add(filepath)
+            hdr = self.get_handler(filepath)
+            if not hdr:
+                counts['unhandled'] += 1
+                return
+            counts['dispatched'] += 1
+            if getattr(hdr, 'batch', False):
+                # dependents are modified whatever the trigger is
+                batch = batches.setdefault((hdr, status), [])
+                batch.append(filepath)
+                if len(batch) >= 512:
+                    self._dispatch_batch(hdr, status, batches.pop((hdr, status)), time.time(),
+                                         True)
+            else:
+                self._dispatch(hdr, status, filepath, time.time(), True)
+
+        try:
+            for filepath in self.iter_matches(pattern):
+                dispatch(filepath, status)
+                if dispatched is not None:
+                    for i in sorted(self.depgraph.get_dependents(filepath)):
+                        if os.path.isfile(i):
+                            dispatch(i, 'modified')
+
+                if time.time() - last_report > 2:
+                    last_report = time.time()
+                    logging.info('%s files dispatched..' % counts['dispatched'])
+
+            for (hdr, batch_status), batch in batches.iteritems():
+                self._dispatch_batch(hdr, batch_status, batch, time.time(), True)
+
+            if self.pool:
+                self.pool.join()
+            self._run_global_handler()
+        finally:
+            if self.pool:
+                self.pool.shutdown()
+                self.pool = None
+        self.save_dependencies()
+        for cmd, p in self.children:
+            p.wait()
+        self.reap_children()
+
+        logging.info('Triggered %s files as %s in %.2fs, %s matched files have no handler' % (
+            counts['dispatched'], status, time.time() - t0, counts['unhandled']))
+
+    def iter_matches(self, pattern=None):
+        """
+        Yield the watched files that match `pattern`, without stat'ing them
+        """
+        top = self.root
+        matcher = None
+        if pattern:
+            matcher = PatternMatcher([pattern], cache_limit=0)
+            prefix = literal_prefix(pattern)
+            if prefix and self.recursive:
+                top = self._prefix + prefix
+                if not os.path.isdir(top) or self._in_ignored_dir(prefix):
+                    return
+
+        for dirpath, dirnames, filenames, filepaths in self.walk(top):
+            for i in filepaths:
+                if matcher is None or matcher.matches(self.relpath(i)):
+                    yield i
+
+    def _in_ignored_dir(self, dirpath):
+        parent = self.root
+        for name in os.path.normpath(dirpath).split('/'):
+            if self.ignore_dir(parent, name):
+                return True
+            parent = os.path.join(parent, name)
+        return False
 
-    def _execute(self, changes):
+    def _is_bulk(self, count, now=None):
+        """
+        Count `count` changes at `now`, return whether `burst` or more came
+        in the last BURST_WINDOW seconds
+        """
+        if not self.burst:
+            return False
+        if now is None:
+            now = time.time()
+        self._recent.append((now, count))
+        self._recent_count += count
+        while self._recent[0][0] <= now - BURST_WINDOW:
+            self._recent_count -= self._recent.popleft()[1]
+        return self._recent_count >= self.burst
+
+    def _execute(self, changes, detected=None):
+        bulk = self._is_bulk(sum(len(i) for i in changes.itervalues()))
 
         #if self.handlers:
         for status, filepaths in changes.iteritems():
+            batches = {}
             for filepath in filepaths:
                 #if self.debug:
                     #print status, filepath
@@ -192,34 +780,178 @@ class Dragline(object):
                 hdr = self.get_handler(filepath)
                 if not hdr:
                     continue
-                if inspect.isclass(hdr):
-                    hdr_instance = hdr(self, *self.get_handler_args(filepath))
-                    getattr(hdr_instance, status)()
-                elif inspect.isfunction(hdr):
-                    hdr(*self.get_handler_args(filepath))
-                elif isinstance(hdr, (str, unicode)):
-                    run_command_str(hdr)
+                if getattr(hdr, 'batch', False):
+                    batches.setdefault(hdr, []).append(filepath)
                 else:
-                    raise Exception('Handler type error, %s' % type(hdr))
+                    self._dispatch(hdr, status, filepath, detected, bulk)
+
+            for hdr, batch in batches.iteritems():
+                self._dispatch_batch(hdr, status, batch, detected, bulk)
 
         if self.global_handler:
-            hdr = self.global_handler
-            if inspect.isfunction(hdr):
-                hdr()
-            elif isinstance(hdr, (str, unicode)):
-                run_command_str(hdr)
+            if self.pool:
+                self._schedule_global_handler()
+            else:
+                self._run_global_handler()
+
+    def _schedule_global_handler(self):
+        """
+        Run the global handler on its own thread once the handlers are done,
+        requests that come in meanwhile are served by one run
+        """
+        with self._global_cond:
+            self._global_pending = True
+            if self._global_thread is None:
+                self._global_thread = threading.Thread(target=self._global_work,
+                                                       name='dragline-global')
+                self._global_thread.daemon = True
+                self._global_thread.start()
+            self._global_cond.notify()
+
+    def _global_work(self):
+        while True:
+            with self._global_cond:
+                while not self._global_pending:
+                    self._global_cond.wait()
+            self.pool.join()
+            with self._global_cond:
+                self._global_pending = False
+            try:
+                self._run_global_handler(wait=True)
+            except Exception:
+                logging.exception('Global handler failed')
+
+    def _dispatch(self, hdr, status, filepath, detected=None, bulk=False):
+        if self.pool:
+            self.pool.submit_latest(filepath, self._run_handler, hdr, status, filepath, detected,
+                                    **get_schedule(hdr, bulk))
+        else:
+            self._run_handler(hdr, status, filepath, detected)
+
+    def _dispatch_batch(self, hdr, status, filepaths, detected=None, bulk=False):
+        # batches of one handler class run in order
+        if self.pool:
+            self.pool.submit(hdr, self._run_batch, hdr, status, filepaths, detected,
+                             **get_schedule(hdr, bulk))
+        else:
+            self._run_batch(hdr, status, filepaths, detected)
+
+    def _run_global_handler(self, wait=False):
+        if not self.global_handler:
+            return
+        hdr = self.global_handler
+        if inspect.isfunction(hdr):
+            hdr()
+        elif isinstance(hdr, (str, unicode)):
+            p = run_command_str(hdr)
+            if wait:
+                self.report_exit(hdr, p.wait())
+            else:
+                # the loop reaps it
+                self.children.append((hdr, p))
+        else:
+            raise Exception('Handler type error, %s' % type(hdr))
+
+    def reap_children(self):
+        """
+        Collect the exit codes of the finished commands in `children`
+        """
+        for cmd, p in list(self.children):
+            if p.poll() is not None:
+                self.children.remove((cmd, p))
+                self.report_exit(cmd, p.returncode)
+
+    def _run_handler(self, hdr, status, filepath, detected=None):
+        t0 = time.time()
+        if detected is not None:
+            self.stats.add('latency.dispatch', t0 - detected)
+        if status != 'removed' and self.is_fresh(hdr, filepath):
+            self.stats.incr('fresh.%s' % get_handler_name(hdr))
+            logging.debug('%s is up to date' % filepath)
+            return
+        try:
+            self._call_handler(hdr, status, filepath)
+        finally:
+            self.stats.add('handler.%s' % get_handler_name(hdr), time.time() - t0)
+
+    def _call_handler(self, hdr, status, filepath):
+        if inspect.isclass(hdr):
+            # a process pool of one worker buys nothing
+            if self.pool and self.pool.workers > 1 and getattr(hdr, 'in_process', False):
+                setup_time, deps, stats = self.pool.run_handler(hdr, status, self.debug, self.root,
+                                                                self.get_handler_args(filepath))
+                for source, i in deps:
+                    self.report_dependencies(source, i)
+                self.stats.merge(stats)
             else:
-                raise Exception('Handler type error, %s' % type(hdr))
+                t0 = time.time()
+                hdr_instance = hdr(self, *self.get_handler_args(filepath))
+                setup_time = time.time() - t0
+                getattr(hdr_instance, status)()
+            self.stats.add('setup.%s' % hdr.__name__, setup_time)
+        elif inspect.isfunction(hdr):
+            hdr(*self.get_handler_args(filepath))
+        elif isinstance(hdr, (str, unicode)):
+            p = run_command_str(hdr)
+            if self.pool:
+                # on a worker thread, so the command counts against the workers
+                self.report_exit(hdr, p.wait())
+            else:
+                self.children.append((hdr, p))
+        else:
+            raise Exception('Handler type error, %s' % type(hdr))
+
+    def _run_batch(self, hdr, status, filepaths, detected=None):
+        t0 = time.time()
+        if detected is not None:
+            self.stats.add('latency.dispatch', t0 - detected)
+        if status != 'removed':
+            stale = [i for i in filepaths if not self.is_fresh(hdr, i)]
+            if len(stale) < len(filepaths):
+                self.stats.incr('fresh.%s' % hdr.__name__, len(filepaths) - len(stale))
+                filepaths = stale
+            if not filepaths:
+                return
+        try:
+            hdr_instance = hdr(self, None, None, None)
+            self.stats.add('setup.%s' % hdr.__name__, time.time() - t0)
+            getattr(hdr_instance, status + '_batch')(filepaths)
+        finally:
+            self.stats.add('batch.%s' % hdr.__name__, time.time() - t0)
+
+    def is_fresh(self, hdr, filepath):
+        """
+        Whether the output `hdr` declares for `filepath` exists and is newer
+        than it and than the files it depends on, as make would tell
+        """
+        output_path = getattr(hdr, 'output_path', None)
+        if output_path is None:
+            return False
+        output = output_path(self.root, filepath)
+        if output is None or output == filepath:
+            return False
+        try:
+            mtime = os.stat(output).st_mtime
+        except OSError:
+            return False
+        for i in itertools.chain([filepath], self.depgraph.get_dependencies(filepath)):
+            try:
+                if os.stat(i).st_mtime > mtime:
+                    return False
+            except OSError:
+                # a dependency is gone, the handler tells what to do about it
+                return False
+        return True
 
     def get_handler_args(self, filepath):
         dirpath, filename = os.path.split(filepath)
         return dirpath, filename, filepath
 
     def get_handler(self, path):
-        for hdr in self.handlers:
-            if fnmatch.fnmatch(path, hdr[0]):
-                return hdr[1]
-        return None
+        index = self.handler_matcher.match(self.relpath(path))
+        if index is None:
+            return None
+        return self.handlers[index][1]
 
     def _make_walk_func(self):
         """
@@ -267,67 +999,156 @@ class Dragline(object):
             logging.debug('Rules:\ndirs: %s\nexts: %s\ndir_exts: %s\nspecs: %s' %
                           (R.dirs, R.exts, R.dir_exts, R.specs))
 
+        def ignore_file(filepath):
+            return R.matcher.matches(self.relpath(filepath))
+
+        def ignore_unwatched_file(filepath):
+            path = self.relpath(filepath)
+            return not R.allow.matches(path) or R.matcher.matches(path)
+
         def check_file(filepath):
             if not os.path.isfile(filepath):
                 # this will ignore symbolic link file
                 return False
 
-            for i in R.files:
-                if fnmatch.fnmatch(filepath, i):
-                    return False
-
-            return True
+            return not ignore_file(filepath)
 
         def check_files(dirpath, filenames):
+            """
+            `filenames` are known to be files, drop the ignored ones
+            """
+            prefix = get_relpath(dirpath, '')
+            if prefix == '.':
+                prefix = ''
+            else:
+                prefix += '/'
             _filenames = []
             _filepaths = []
             for i in filenames:
-                filepath = get_relpath(dirpath, i)
-                if check_file(filepath):
+                filepath = prefix + i
+                if not ignore_file(filepath):
                     _filenames.append(i)
                     _filepaths.append(filepath)
             return _filenames, _filepaths
 
         if self.watches:
-            raise NotImplementedError('watch mode not implemented')
+            logging.debug('Detected Watch Mode, constructing walk function')
+
+            R.allow = AllowList(self.watches)
+            R.matcher = PatternMatcher(sorted(_ext_ignores))
+            ignore_file = ignore_unwatched_file
+
+            def ignore_dir(dirpath, name):
+                if name in _dir_ignores:
+                    return True
+                # only descend into directories that could contain a watched file
+                return not R.allow.may_contain(self.relpath(get_relpath(dirpath, name)))
         else:
             logging.debug('Detected Ignore Mode, constructing walk function')
 
             analyse(self.ignores)
             R.exts.update(_ext_ignores)
             R.files.update(_ext_ignores)
+            R.matcher = PatternMatcher(sorted(R.files))
 
-            def react(dirpath, dirnames, filenames):
-                if R.dirs:
-                    dirnames[:] = [i for i in dirnames
-                                   if (not i in _dir_ignores
-                                       and not get_relpath(dirpath, i) in R.dirs)]
-                else:
-                    dirnames[:] = [i for i in dirnames
-                                   if not i in _dir_ignores]
+            def ignore_dir(dirpath, name):
+                if name in _dir_ignores:
+                    return True
+                if R.dirs and self.relpath(get_relpath(dirpath, name)) in R.dirs:
+                    return True
+                return False
+
+        self._gitignore = None
+        if self.gitignore:
+            gitignore = self._gitignore = GitIgnore(self.root)
+            rules_ignore_file = ignore_file
+            rules_ignore_dir = ignore_dir
+
+            def ignore_file(filepath):
+                return rules_ignore_file(filepath) or gitignore.ignored(filepath)
+
+            def ignore_dir(dirpath, name):
+                if rules_ignore_dir(dirpath, name):
+                    return True
+                return gitignore.ignored(get_relpath(dirpath, name), True)
+
+        def react(dirpath, dirnames, filenames):
+            dirnames[:] = [i for i in dirnames if not ignore_dir(dirpath, i)]
+
+            filenames[:], filepaths = check_files(dirpath, filenames)
+            return dirpath, dirnames, filenames, filepaths
+
+        # filepath -> DirEntry of the files of the directory being walked,
+        # so that `get_stat` reuses the stat of the listing
+        R.entries = {}
+
+        def get_entry_stat(filepath):
+            entry = R.entries.get(filepath)
+            if entry is None:
+                return get_stat(filepath)
+            st = entry.stat()
+            return st.st_mtime, st.st_size
+
+        if self.scanner == 'incremental':
+            scanner = IncrementalScanner(react, self.recursive, self.restat_batch, self.root)
+            self.get_stat = scanner.get_stat
+        elif self.scanner == 'full':
+            scanner = None
+            self.get_stat = get_entry_stat
+        else:
+            raise Exception('Scanner should be one of full, incremental')
+
+        def scan(top):
+            stack = [top]
+            while stack:
+                dirpath = stack.pop()
+                try:
+                    dirnames, links, filenames, entries = list_dir(dirpath)
+                except OSError:
+                    continue
+                logging.debug('list_dir : %s, %s, %s', dirpath, dirnames, filenames)
+
+                # before `react`, which drops the ignored files from `filenames`
+                if entries is not None:
+                    by_name = dict((i.name, i) for i in entries)
+                rv = react(dirpath, dirnames, filenames)
+                if entries is not None:
+                    R.entries = dict((fp, by_name[fn]) for fn, fp in zip(rv[2], rv[3]))
+                yield rv
 
-                filenames[:], filepaths = check_files(dirpath, filenames)
-                return dirpath, dirnames, filenames, filepaths
+                if not self.recursive:
+                    break
+                for i in reversed(dirnames):
+                    if not i in links:
+                        stack.append(os.path.join(dirpath, i))
 
-        def _walk():
+        def _walk(top=None):
             t0 = time.time()
+            if top is None:
+                top = self.root
 
             # manually produce dragline package files for the first loop
             #yield _dragline_dirpath, [], _dragline_filenames, _dragline_filepaths
 
-            # `dirpath` is absolute path iff dragline package files in the first loop
-            # other times it is relative path without './' at the beginning
-            for dirpath, dirnames, filenames in os.walk('.'):
-                logging.debug('os.walk  : %s, %s, %s' % (dirpath, dirnames, filenames))
-                yield react(dirpath, dirnames, filenames)
-
-                if not self.recursive:
-                    break
+            if scanner:
+                for i in scanner.walk(top):
+                    yield i
+            else:
+                try:
+                    for i in scan(top):
+                        yield i
+                finally:
+                    # DirEntry caches its stat, which must not outlive the walk
+                    R.entries = {}
             t1 = time.time()
             self.walk_time_cost = t1 - t0  # unit: second
             logging.debug('walk time cost: %s' % self.walk_time_cost)
 
         self.walk = _walk
+        self._scanner = scanner
+        self.check_file = check_file
+        self.ignore_file = ignore_file
+        self.ignore_dir = ignore_dir
 
 
 def is_dir_family(p1, p2):
@@ -354,13 +1175,103 @@ def in_dir(pth, dir):
         return False
 
 
+class MultiDragline(object):
+    """
+    Watch several roots from one process, each root is a `Dragline` with its
+    own rules, they share one worker pool and one wait on their watchers
+    """
+    def __init__(self, roots, workers=1, supersede='queue'):
+        """
+        `roots` is a list of (root, kwargs of `Dragline`)
+        """
+        if workers > 0:
+            self.pool = HandlerPool(workers, supersede=supersede)
+        else:
+            self.pool = None
+        self.workers = workers
+        self.draglines = []
+        for root, kwargs in roots:
+            kwargs = dict(kwargs)
+            kwargs.update(root=root, pool=self.pool, workers=0, supersede=supersede)
+            self.draglines.append(Dragline(**kwargs))
+
+    def start(self):
+        try:
+            for i in self.draglines:
+                i.setup()
+            # profiling is per thread, let the first root own it
+            signal.signal(signal.SIGUSR1, self.draglines[0]._toggle_profile)
+
+            while True:
+                wait_for(self.draglines, min(i.wait_time() for i in self.draglines))
+                for i in self.draglines:
+                    i.tick()
+        except KeyboardInterrupt:
+            print 'dragline interrupted, waiting for running handlers..'
+        finally:
+            for i in self.draglines:
+                i.stop()
+
+    def trigger(self, action, pattern, jobs=None):
+        for i in self.draglines:
+            # each run shuts its pool down when it is done
+            i.trigger(action, pattern, jobs or self.workers)
+
+
+def wait_for(draglines, timeout):
+    """
+    Sleep until one of the watchers of `draglines` that has a file descriptor
+    gets events, or a control command comes in, or for `timeout` seconds
+    """
+    fds = []
+    for i in draglines:
+        fds.extend(i.filenos())
+    if not fds:
+        time.sleep(timeout)
+        return
+    try:
+        select.select(fds, [], [], timeout)
+    except select.error, e:
+        if e.args[0] != errno.EINTR:
+            raise
+
+
+def get_handler_name(hdr):
+    if isinstance(hdr, (str, unicode)):
+        return 'command'
+    return hdr.__name__
+
+
+def get_schedule(hdr, bulk=False):
+    """
+    The `HandlerPool.submit` options of a handler
+    """
+    return {
+        'priority': getattr(hdr, 'priority', 0),
+        'bulk': bulk,
+        'group': get_handler_name(hdr),
+        'limit': getattr(hdr, 'concurrency', None),
+    }
+
+
 def get_relpath(dirpath, name):
     return os.path.relpath(os.path.join(dirpath, name), '.')
 
 
-def parse_config():
-    sys.path.insert(0, os.getcwd())
-    import dragconfig as config
+def parse_config(root='.', config=None):
+    """
+    Read the dragconfig.py of `root`, or the options in the dict `config`
+    """
+    if config is not None:
+        options = config
+        config = EmptyClass()
+        config.__dict__.update(options)
+    elif root == '.':
+        sys.path.insert(0, os.getcwd())
+        import dragconfig as config
+    else:
+        name = 'dragconfig_' + re.sub(r'\W', '_', os.path.normpath(root))
+        config = imp.load_source(name, os.path.join(root, 'dragconfig.py'))
 
     kwargs = {
         'ignores': [],
@@ -369,7 +1280,22 @@ def parse_config():
         'global_handler': None,
         'interval': 300,
         'recursive': True,
-        'debug': False
+        'debug': False,
+        'backend': 'auto',
+        'scanner': 'full',
+        'restat_batch': 0,
+        'workers': 1,
+        'debounce': 0,
+        'checksum': False,
+        'snapshot': False,
+        'prewarm': False,
+        'stats_interval': 0,
+        'profile': False,
+        'control': None,
+        'supersede': 'queue',
+        'roots': [],
+        'gitignore': False,
+        'burst': 50
     }
 
     for k in kwargs:
@@ -379,24 +1305,51 @@ def parse_config():
     return kwargs
 
 
+def parse_roots(roots):
+    """
+    ROOTS items are either the path of a root that has its own dragconfig.py,
+    or (path, dict of options named as in dragconfig.py)
+    """
+    rv = []
+    for i in roots:
+        if isinstance(i, (list, tuple)):
+            root, kwargs = i[0], parse_config(i[0], i[1])
+        else:
+            root, kwargs = i, parse_config(i)
+        kwargs.pop('roots')
+        rv.append((root, kwargs))
+    return rv
+
+
 def main():
     import argparse
 
+    if sys.argv[1:2] == ['bench']:
+        from .bench import main as bench_main
+        return bench_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description='Monitor files and do relevant things')
     parser.add_argument('-t', dest='trigger', nargs=2, metavar=('action', 'pattern'),
                         help="trigger files that match the pattern,\
                         with the action which + means added, ^ means modified, - means removed,\
                         if pattern is 'all', all files will be triggered")
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, metavar='N',
+                        help='number of handlers to run at the same time, overrides WORKERS')
     args = parser.parse_args()
 
     if args.trigger and not args.trigger[0] in TRIGGER_FLAG:
         raise argparse.ArgumentTypeError('first argument after -t should be one of %s' % ', '.join(TRIGGER_FLAG))
 
     #sys.exit()
-    drag = Dragline(**parse_config())
+    kwargs = parse_config()
+    roots = kwargs.pop('roots')
+    if roots:
+        drag = MultiDragline(parse_roots(roots), kwargs['workers'], kwargs['supersede'])
+    else:
+        drag = Dragline(**kwargs)
 
     if args.trigger:
-        drag.trigger(*tuple(args.trigger))
+        drag.trigger(*tuple(args.trigger), jobs=args.jobs)
     else:
         drag.start()
 
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import logging
+import threading
+
+
+class DependencyGraph(object):
+    """
+    Which files each source read when it was compiled, and the reverse index
+    from a dependency to the sources that read it
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deps = {}  # source -> set of dependencies
+        self.dependents = {}  # dependency -> set of sources
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.deps)
+
+    def set_dependencies(self, source, deps):
+        deps = set(deps)
+        deps.discard(source)
+        with self.lock:
+            old = self.deps.get(source, set())
+            if old == deps:
+                return
+            for i in old - deps:
+                sources = self.dependents.get(i)
+                if sources:
+                    sources.discard(source)
+                    if not sources:
+                        del self.dependents[i]
+            for i in deps - old:
+                self.dependents.setdefault(i, set()).add(source)
+            if deps:
+                self.deps[source] = deps
+            else:
+                self.deps.pop(source, None)
+            self.dirty = True
+
+    def remove(self, source):
+        self.set_dependencies(source, ())
+
+    def get_dependents(self, path):
+        """
+        All the sources that depend on `path`, directly or not
+        """
+        rv = set()
+        with self.lock:
+            stack = [path]
+            while stack:
+                for i in self.dependents.get(stack.pop(), ()):
+                    if not i in rv and i != path:
+                        rv.add(i)
+                        stack.append(i)
+        return rv
+
+    def get_dependencies(self, source):
+        """
+        All the files `source` depends on, directly or not
+        """
+        rv = set()
+        with self.lock:
+            stack = [source]
+            while stack:
+                for i in self.deps.get(stack.pop(), ()):
+                    if not i in rv and i != source:
+                        rv.add(i)
+                        stack.append(i)
+        return rv
+
+    def save(self, path):
+        with self.lock:
+            data = dict((k, sorted(v)) for k, v in self.deps.iteritems())
+            self.dirty = False
+        dirpath = os.path.dirname(path)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        tmp_path = path + '.tmp'
+        f = open(tmp_path, 'w')
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        f = open(path)
+        try:
+            data = json.load(f)
+        except ValueError:
+            logging.warning('dependency file %s is corrupted, ignored' % path)
+            return
+        finally:
+            f.close()
+        for source, deps in data.iteritems():
+            self.set_dependencies(source.encode('utf8'), [i.encode('utf8') for i in deps])
+        self.dirty = False
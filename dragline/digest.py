@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import logging
+
+try:
+    import xxhash
+    _new_hash = xxhash.xxh64
+except ImportError:
+    # not for security, md5 is the fastest one in hashlib
+    _new_hash = hashlib.md5
+
+
+def stat_key(st):
+    """
+    What identifies a version of a file without reading it
+    """
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return st.st_ino, st.st_size, mtime_ns
+
+
+def file_digest(path, blocksize=65536):
+    h = _new_hash()
+    f = open(path, 'rb')
+    try:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+class DigestCache(object):
+    """
+    Content digests of files keyed on (inode, size, mtime_ns), so a file is read
+    only when its stat changed, and read at most once for each version
+    """
+    def __init__(self):
+        self.entries = {}  # path -> (stat key, digest)
+
+    def digest(self, path):
+        key = stat_key(os.stat(path))
+        cached = self.entries.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        digest = file_digest(path)
+        self.entries[path] = (key, digest)
+        return digest
+
+    def changed(self, path):
+        """
+        Whether the content of `path` differs from the last time it was seen.
+        A file never seen before counts as changed.
+        """
+        cached = self.entries.get(path)
+        try:
+            digest = self.digest(path)
+        except (OSError, IOError):
+            self.entries.pop(path, None)
+            return True
+        return cached is None or cached[1] != digest
+
+    def forget(self, path):
+        self.entries.pop(path, None)
+
+    def seed(self, paths):
+        """
+        Take the digests of `paths` that have none yet, so that their first
+        change could be compared
+        """
+        count = 0
+        for i in paths:
+            if not i in self.entries:
+                try:
+                    self.digest(i)
+                except (OSError, IOError):
+                    continue
+                count += 1
+        return count
+
+    def save(self, path):
+        data = dict((k, list(key) + [digest]) for k, (key, digest) in self.entries.iteritems())
+        dirpath = os.path.dirname(path)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        tmp_path = path + '.tmp'
+        f = open(tmp_path, 'w')
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        f = open(path)
+        try:
+            data = json.load(f)
+        except ValueError:
+            logging.warning('digest file %s is corrupted, ignored' % path)
+            return
+        finally:
+            f.close()
+        for k, (ino, size, mtime_ns, digest) in data.iteritems():
+            self.entries[k.encode('utf8')] = ((ino, size, mtime_ns), digest.encode('utf8'))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+
+def empty_changes():
+    return {
+        'added': [],
+        'modified': [],
+        'removed': []
+    }
+
+
+# how a pending status combines with a newer one on the same path,
+# combinations not listed here resolve to the newer status
+_merge_rules = {
+    ('added', 'modified'): 'added',
+    ('added', 'removed'): None,
+    ('removed', 'added'): 'modified',
+    ('modified', 'removed'): 'removed',
+}
+
+
+def merge_status(old, new):
+    """
+    Return the status that stands for `old` followed by `new`,
+    None means the two cancel out
+    """
+    return _merge_rules.get((old, new), new)
+
+
+class Coalescer(object):
+    """
+    Hold changes until no new change came in for `window` seconds,
+    collapsing the events of each path into one with `merge_status`
+    """
+    def __init__(self, window):
+        self.window = window
+        self.pending = {}  # path -> status
+        self.last_time = None
+
+    def add(self, path, status):
+        if path in self.pending:
+            status = merge_status(self.pending[path], status)
+            if status is None:
+                del self.pending[path]
+                return
+        self.pending[path] = status
+
+    def feed(self, changes):
+        fed = False
+        for status, paths in changes.iteritems():
+            for i in paths:
+                self.add(i, status)
+                fed = True
+        if fed:
+            self.last_time = time.time()
+
+    def remaining(self):
+        """
+        Seconds left before the window is quiet, None if nothing is pending
+        """
+        if not self.pending:
+            return None
+        return max(0, self.last_time + self.window - time.time())
+
+    def ready(self):
+        return self.remaining() == 0
+
+    def flush(self):
+        changes = empty_changes()
+        for path, status in self.pending.iteritems():
+            changes[status].append(path)
+        self.pending = {}
+        return changes
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Ignore rules read from .gitignore and .draglineignore files, with the
+# semantics of gitignore(5): negation, anchoring, directory-only rules, `**`.
+# Paths are relative to the working directory like everywhere in dragline.
+
+import os
+import re
+import time
+
+
+IGNORE_FILES = ('.gitignore', '.draglineignore')
+
+
+def translate(pattern):
+    """
+    Translate the glob of one gitignore rule into a regex,
+    `*` and `?` do not match '/', `**` does
+    """
+    i, n = 0, len(pattern)
+    res = ''
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            if pattern[i:i + 1] == '*':
+                i += 1
+                if pattern[i:i + 1] == '/':
+                    # '**/' matches zero or more directories
+                    i += 1
+                    res += '(?:.*/)?'
+                else:
+                    res += '.*'
+            else:
+                res += '[^/]*'
+        elif c == '?':
+            res += '[^/]'
+        elif c == '\\' and i < n:
+            res += re.escape(pattern[i])
+            i += 1
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                res += '\\['
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] in '!^':
+                    stuff = '^' + stuff[1:]
+                res += '[%s]' % stuff
+        else:
+            res += re.escape(c)
+    return res
+
+
+def parse_rules(lines):
+    """
+    Return a list of (regex, negated, dir_only) of the rules in `lines`,
+    the regexes match paths relative to the directory of the ignore file
+    """
+    rules = []
+    for line in lines:
+        line = line.rstrip('\n').rstrip('\r')
+        # trailing spaces are ignored unless escaped
+        stripped = line.rstrip(' ')
+        if stripped.endswith('\\') and len(stripped) < len(line):
+            stripped += ' '
+        line = stripped
+        if not line or line.startswith('#'):
+            continue
+
+        negated = False
+        if line.startswith('!'):
+            negated = True
+            line = line[1:]
+        elif line.startswith('\\!') or line.startswith('\\#'):
+            line = line[1:]
+
+        dir_only = False
+        if line.endswith('/'):
+            dir_only = True
+            line = line.rstrip('/')
+        if not line:
+            continue
+
+        # a rule with a slash other than a trailing one is anchored to the
+        # directory of the ignore file, otherwise it matches at any depth
+        if '/' in line:
+            regex = translate(line.lstrip('/'))
+        else:
+            regex = '(?:.*/)?' + translate(line)
+        rules.append((re.compile('(?s)%s\\Z' % regex), negated, dir_only))
+    return rules
+
+
+class GitIgnore(object):
+    """
+    The ignore rules that apply under `root`, the rules of each directory are
+    cached and read again when one of its ignore files changed, which is
+    checked at most once every `check_interval` seconds per directory
+    """
+    check_interval = 1.0
+
+    def __init__(self, root='.', filenames=IGNORE_FILES):
+        self.root = os.path.normpath(root)
+        self.filenames = filenames
+        # dirpath -> [checked time, key of the ignore files, own rules,
+        #             rules of the parent it was combined with, combined rules]
+        self._cache = {}
+        # directories whose rules were read again since `changed_dirs`
+        self._changed = set()
+        self._last_check = time.time()
+
+    def ignored(self, path, is_dir=False):
+        """
+        Whether `path`, a file or a directory under the root, is ignored
+        """
+        dirpath = os.path.dirname(path) or '.'
+        rv = False
+        for base, regex, negated, dir_only in self._rules(dirpath):
+            if dir_only and not is_dir:
+                continue
+            if base == '.':
+                relpath = path
+            else:
+                relpath = path[len(base) + 1:]
+            if regex.match(relpath):
+                rv = not negated
+        return rv
+
+    def _rules(self, dirpath):
+        """
+        The rules that apply to the entries of `dirpath`, those of the root
+        first and those of `dirpath` last, since later rules take precedence
+        """
+        parent = self._parent(dirpath)
+        if parent is None:
+            parent_rules = None
+        else:
+            parent_rules = self._rules(parent)
+
+        entry = self._cache.get(dirpath)
+        now = time.time()
+        if entry is not None and entry[3] is parent_rules and now - entry[0] < self.check_interval:
+            return entry[4]
+
+        key = self._key(dirpath)
+        if entry is not None and entry[1] == key:
+            entry[0] = now
+            if entry[3] is parent_rules:
+                return entry[4]
+            own = entry[2]
+        else:
+            if entry is not None:
+                self._changed.add(dirpath)
+            own = self._read(dirpath)
+
+        combined = list(parent_rules or []) + own
+        self._cache[dirpath] = [now, key, own, parent_rules, combined]
+        return combined
+
+    def forget(self, dirpath):
+        """
+        Read the rules of `dirpath` again on next use, the directories under
+        it combine them again since they see a new list of parent rules
+        """
+        self._cache.pop(os.path.normpath(dirpath), None)
+
+    def changed_dirs(self):
+        """
+        The directories whose ignore files changed since the last call,
+        checked at most once every `check_interval` seconds
+        """
+        now = time.time()
+        if now - self._last_check < self.check_interval:
+            return []
+        self._last_check = now
+        for dirpath, entry in self._cache.items():
+            if self._key(dirpath) != entry[1]:
+                self.forget(dirpath)
+                self._changed.add(dirpath)
+        rv, self._changed = sorted(self._changed), set()
+        return rv
+
+    def _parent(self, dirpath):
+        if dirpath == self.root or dirpath == '.':
+            return None
+        return os.path.dirname(dirpath) or '.'
+
+    def _key(self, dirpath):
+        key = []
+        for name in self.filenames:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+                key.append((st.st_mtime, st.st_size))
+            except OSError:
+                key.append(None)
+        return key
+
+    def _read(self, dirpath):
+        rules = []
+        for name in self.filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                f = open(path)
+            except IOError:
+                continue
+            try:
+                for regex, negated, dir_only in parse_rules(f):
+                    rules.append((dirpath, regex, negated, dir_only))
+            finally:
+                f.close()
+        return rules
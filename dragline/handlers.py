@@ -7,6 +7,54 @@ import shlex
 import os
 import re
 import codecs
+import threading
+import json
+import glob
+
+from .cache import BuildCache, make_key
+from .digest import DigestCache
+from .nodeworker import get_worker
+from .pool import current_task
+
+
+def get_arg_max():
+    """
+    Bytes available for the arguments of a new process
+    """
+    try:
+        arg_max = os.sysconf('SC_ARG_MAX')
+    except (ValueError, OSError, AttributeError):
+        arg_max = 131072
+    if arg_max <= 0:
+        arg_max = 131072
+    env_size = sum(len(k) + len(v) + 2 + 8 for k, v in os.environ.iteritems())
+    # leave some headroom for the loader
+    return arg_max - env_size - 4096
+
+
+def chunk_argv(cmd, filepaths, suffix=(), limit=None):
+    """
+    Yield `cmd + chunk + suffix` argvs, with the chunks of `filepaths`
+    made small enough to stay under ARG_MAX
+    """
+    if limit is None:
+        limit = get_arg_max()
+    cmd = list(cmd)
+    suffix = list(suffix)
+    # each argument takes its bytes, a NUL and a pointer
+    base = sum(len(i) + 9 for i in cmd + suffix)
+    chunk = []
+    size = base
+    for i in filepaths:
+        cost = len(i) + 9
+        if chunk and size + cost > limit:
+            yield cmd + chunk + suffix
+            chunk = []
+            size = base
+        chunk.append(i)
+        size += cost
+    if chunk:
+        yield cmd + chunk + suffix
 
 
 def run_command_str(cmd_str, *args, **kwargs):
@@ -25,6 +73,15 @@ def add_tab(s):
     return s.replace('\n', '\n' + _print_tab)
 
 
+def lreplace(root, s, ori, sub):
+    # a path under another root is replaced relative to the root, so that
+    # the same rules work whichever root they are used in
+    if root != '.' and s.startswith(root + '/'):
+        prefix = root + '/'
+        return prefix + re.sub('^%s' % ori, sub, s[len(prefix):])
+    return re.sub('^%s' % ori, sub, s)
+
+
 class DependenceUnexist(Exception):
     pass
 
@@ -37,12 +94,37 @@ def check_python_dep(dep, clsname):
             'Python module %s dependence is not satisfied on class %s' % (dep, clsname))
 
 
+# node module -> whether it could be required
+_node_deps = {}
+
+
+def check_node_deps(deps, clsname):
+    """
+    Check all `deps` with one node process, results are remembered
+    so that every module is checked once
+    """
+    unknown = [i for i in deps if not i in _node_deps]
+    if unknown:
+        jscode = ('var missing = [];'
+                  '%s.forEach(function (m) { try { require(m); } catch (e) { missing.push(m); } });'
+                  'console.log(JSON.stringify(missing));') % json.dumps(unknown)
+        p = sp.Popen(['node', '-e', jscode], stdout=sp.PIPE, stderr=sp.PIPE)
+        stdoutdata, stderrdata = p.communicate()
+        try:
+            missing = json.loads(stdoutdata)
+        except ValueError:
+            missing = unknown
+        for i in unknown:
+            _node_deps[i] = not i in missing
+
+    for i in deps:
+        if not _node_deps[i]:
+            raise DependenceUnexist(
+                'NodeJS module %s dependence is not satisfied on class %s' % (i, clsname))
+
+
 def check_node_dep(dep, clsname):
-    jscode = 'require("%s")' % dep
-    rv = sp.call(['node', '-e', jscode], stdout=sp.PIPE, stderr=sp.PIPE)
-    if rv != 0:
-        raise DependenceUnexist(
-            'NodeJS module %s dependence is not satisfied on class %s' % (dep, clsname))
+    check_node_deps([dep], clsname)
 
 
 class _DependentMeta(type):
@@ -53,11 +135,10 @@ class _DependentMeta(type):
         if 'DEPENDENCES' in attrs:
             for env, packages in attrs['DEPENDENCES'].iteritems():
                 if 'python' == env:
-                    check = check_python_dep
+                    for i in packages:
+                        check_python_dep(i, name)
                 elif 'node' == env:
-                    check = check_node_dep
-                for i in packages:
-                    check(i, name)
+                    check_node_deps(packages, name)
         return type.__new__(cls, name, bases, attrs)
 
 
@@ -66,8 +147,30 @@ class DependentClass(object):
 
 
 class ActionHandler(DependentClass):
+    # run in a worker process instead of a worker thread when WORKERS > 1,
+    # for handlers that spend their time in python rather than in a subprocess
+    in_process = False
+
+    # when True, all the files of one change set that have the same status are
+    # passed to one `<status>_batch` call on an instance whose filepath is None
+    batch = False
+
+    # handlers of a higher priority are run first when changes queue up
+    priority = 0
+
+    # at most that many of this handler run at the same time, None is no limit
+    concurrency = None
+
+    # the output of a file, as the (pattern, replacement) of `lreplace` and
+    # `rreplace` applied to its path, e.g. ('stylus', 'public/stylesheets') and
+    # ('.styl', '.css'); when either is set, added and modified files whose
+    # output is newer than them and than what they depend on are skipped
+    output_lreplace = None
+    output_rreplace = None
+
     def __init__(self, dragline, dirpath, filename, filepath):
         self.dragline = dragline
+        self.root = getattr(dragline, 'root', '.')
         self.dirpath = dirpath
         self.filename = filename
         self.filepath = filepath
@@ -86,6 +189,24 @@ class ActionHandler(DependentClass):
     def removed(self):
         raise NotImplementedError('no removed method defined')
 
+    def added_batch(self, filepaths):
+        self.fan_out('added', filepaths)
+
+    def modified_batch(self, filepaths):
+        self.fan_out('modified', filepaths)
+
+    def removed_batch(self, filepaths):
+        self.fan_out('removed', filepaths)
+
+    def fan_out(self, status, filepaths):
+        """
+        Call the per-file `status` method for each of `filepaths`
+        """
+        for i in filepaths:
+            dirpath, filename = os.path.split(i)
+            hdr = self.__class__(self.dragline, dirpath, filename, i)
+            getattr(hdr, status)()
+
     def mkdir(self, anypath):
         if not anypath:
             return
@@ -97,7 +218,37 @@ class ActionHandler(DependentClass):
             os.makedirs(dirpath)
 
     def lreplace(self, s, ori, sub):
-        return re.sub('^%s' % ori, sub, s)
+        return lreplace(self.root, s, ori, sub)
+
+    @classmethod
+    def output_path(cls, root, filepath):
+        """
+        The output of `filepath` by `output_lreplace` and `output_rreplace`,
+        None if the handler declares no output
+        """
+        if cls.output_lreplace is None and cls.output_rreplace is None:
+            return None
+        output = filepath
+        if cls.output_lreplace is not None:
+            output = lreplace(root, output, *cls.output_lreplace)
+        if cls.output_rreplace is not None:
+            output = re.sub('%s$' % cls.output_rreplace[0], cls.output_rreplace[1], output)
+        return output
+
+    @property
+    def output(self):
+        if self.filepath is None:
+            return None
+        return self.output_path(self.root, self.filepath)
+
+    @property
+    def relpath(self):
+        """
+        `filepath` relative to the root
+        """
+        if self.root != '.' and self.filepath.startswith(self.root + '/'):
+            return self.filepath[len(self.root) + 1:]
+        return self.filepath
 
     def rreplace(self, s, ori, sub):
         return re.sub('%s$' % ori, sub, s)
@@ -128,12 +279,33 @@ class CommandHandler(ActionHandler):
             kwargs['stdout'] = sp.PIPE
         if not 'stderr' in kwargs:
             kwargs['stderr'] = sp.PIPE
-        self.p = sp.Popen(cmd, *args, **kwargs)
 
-        self.stdoutdata, self.stderrdata = self.p.communicate()
+        # a newer change of the file could cancel this command, see HandlerPool
+        task = current_task()
+        if task:
+            task.check()
+        self.p = sp.Popen(cmd, *args, **kwargs)
+        if task:
+            task.attach(self.p)
+        try:
+            self.stdoutdata, self.stderrdata = self.p.communicate()
+        finally:
+            if task:
+                task.detach(self.p)
+        if task:
+            task.check()
+        self.dragline.report_exit(cmd, self.p.returncode)
 
         self._log_command()
 
+    def run_command_batch(self, cmd, filepaths, suffix=(), *args, **kwargs):
+        """
+        Run `cmd + filepaths + suffix` as few times as ARG_MAX allows,
+        e.g. `self.run_command_batch(['cp'], filepaths, ['public/'])`
+        """
+        for argv in chunk_argv(cmd, filepaths, suffix):
+            self.run_command(argv, *args, **kwargs)
+
     def _log_command(self):
         if not hasattr(self, 'stdoutdata') or not hasattr(self, 'stderrdata'):
             raise Exception('No attributes stdoutdata or stderrdata, check whether you have assigned them')
@@ -156,14 +328,100 @@ class CommandHandler(ActionHandler):
             print add_tab(self.stderrdata)
 
 
+def resolve_import(name, importer, ext, paths=()):
+    """
+    Find the files that `name`, imported by the file `importer`, refers to,
+    looking in the directory of `importer` then in `paths`
+    """
+    name = name.lstrip('/')
+    if name.endswith(ext) or '*' in name:
+        candidates = [name]
+    else:
+        candidates = [name + ext, name, os.path.join(name, 'index' + ext)]
+    for dirpath in [os.path.dirname(importer)] + list(paths):
+        for i in candidates:
+            path = os.path.normpath(os.path.join(dirpath, i))
+            if '*' in path:
+                found = sorted(j for j in glob.glob(path) if os.path.isfile(j))
+                if found:
+                    return found
+            elif os.path.isfile(path):
+                return [path]
+    return []
+
+
+def follow_imports(source, content, regex, ext, paths=()):
+    """
+    All the files that `source` imports directly or through other
+    imported files, `regex` finds the imported names in a file
+    """
+    found = set()
+    stack = [(source, content)]
+    while stack:
+        path, text = stack.pop()
+        if text is None:
+            try:
+                f = open(path)
+                text = f.read()
+                f.close()
+            except IOError:
+                continue
+        for name in regex.findall(text):
+            for i in resolve_import(name, path, ext, paths):
+                if not i in found and i != source:
+                    found.add(i)
+                    stack.append((i, None))
+    return found
+
+
+# shared by all compile handlers of the process
+_build_cache = None
+
+_digests = DigestCache()
+
+# (handler class, options) -> compiler, created once per process
+_compilers = {}
+
+_compilers_lock = threading.Lock()
+
+
+def get_build_cache(max_bytes):
+    global _build_cache
+    if _build_cache is None:
+        with _compilers_lock:
+            if _build_cache is None:
+                _build_cache = BuildCache(max_bytes)
+    return _build_cache
+
+
 class CompileHandler(ActionHandler):
-    _compiler = None
+    in_process = True
+
+    # bytes of compiled output kept in memory for reuse, 0 disables the cache
+    cache_size = 32 * 1024 * 1024
 
     def initialize(self):
-        cls = self.__class__
-        cls._compiler = {
-            'compiler': cls.get_compiler()
-        }
+        self._compiler = self.warm()
+
+    @classmethod
+    def warm(cls):
+        """
+        Return the compiler of the class, it is created on first call and reused
+        by all the instances while the options stay the same
+        """
+        key = (cls, cls.cache_options())
+        compiler = _compilers.get(key)
+        if compiler is None:
+            with _compilers_lock:
+                compiler = _compilers.get(key)
+                if compiler is None:
+                    compiler = _compilers[key] = cls.get_compiler()
+        if getattr(cls, 'node_worker', False):
+            worker = get_worker()
+            with worker.lock:
+                if not worker.alive():
+                    worker.start()
+        return compiler
 
     def read_file(self, path):
         f = codecs.open(path, 'r', 'utf8')
@@ -172,17 +430,88 @@ class CompileHandler(ActionHandler):
         return content
 
     def write_file(self, path, content):
+        """
+        Write `content` to `path` unless the file already holds exactly that,
+        in which case its mtime is only bumped, so that the output reads as
+        newer than its sources; return whether the file was written
+        """
         #print repr(content)
+        if os.path.isfile(path):
+            f = codecs.open(path, 'r', 'utf8')
+            try:
+                same = f.read() == content
+            except UnicodeDecodeError:
+                same = False
+            f.close()
+            if same:
+                os.utime(path, None)
+                return False
         f = codecs.open(path, 'w', 'utf8')
         f.write(content)
         f.close()
+        return True
 
-    def get_compiler(self):
+    @classmethod
+    def get_compiler(cls):
         raise NotImplementedError
 
+    @classmethod
+    def cache_options(cls):
+        """
+        Options of the handler that affect the compiled output
+        """
+        return ()
+
+    def find_dependencies(self, source, content):
+        """
+        Files other than `source` that compiling it reads, e.g. imports
+        """
+        return set()
+
+    def cache_key(self, content, deps):
+        cls = self.__class__
+        digests = []
+        for i in sorted(deps):
+            try:
+                digests.append((i, _digests.digest(i)))
+            except (OSError, IOError):
+                digests.append((i, None))
+        return make_key(cls.__module__, cls.__name__, self.cache_options(), content, digests)
+
+    def compile_file(self, source, output, compile_func):
+        """
+        Compile `source` into `output` with `compile_func`, which takes and returns
+        unicode. The output is taken from the build cache if the same source was
+        compiled before with the same options and dependencies. The dependencies
+        are reported to dragline, so that changing one of them rebuilds `source`.
+
+        Return whether the output came from the cache
+        """
+        content = self.read_file(source)
+        deps = self.find_dependencies(source, content.encode('utf8'))
+        self.compiler_deps = set()
+
+        result = None
+        if self.cache_size:
+            cache = get_build_cache(self.cache_size)
+            key = self.cache_key(content, deps)
+            result = cache.get(key)
+        hit = result is not None
+
+        if not hit:
+            result = compile_func(content)
+            if self.cache_size:
+                cache.set(key, result)
+
+        self.dragline.report_dependencies(source, deps | self.compiler_deps)
+
+        self.mkdir(output)
+        self.write_file(output, result)
+        return hit
+
     @property
     def compiler(self):
-        return self.__class__._compiler['compiler']
+        return self._compiler
 
 
 class StylusHandler(CompileHandler):
@@ -195,6 +524,10 @@ class StylusHandler(CompileHandler):
     compress = True
     paths = []
 
+    # compile in the long-lived node worker instead of the python bridge,
+    # which starts a node process for every file
+    node_worker = False
+
     @classmethod
     def get_compiler(cls):
         from stylus import Stylus
@@ -204,12 +537,33 @@ class StylusHandler(CompileHandler):
             compiler.use(i)
         return compiler
 
-    def stylus(self, source, output):
-        self.mkdir(output)
+    @classmethod
+    def cache_options(cls):
+        return cls.compress, tuple(cls.paths), tuple(cls.plugins), cls.node_worker
+
+    _import_regex = re.compile(r'^\s*@(?:import|require)\s+(?:url\()?\s*[\'"]?([^\'"\)\s;]+)', re.M)
 
-        self.write_file(output,
-                        self.compiler.compile(self.read_file(source)))
-        self.log(True, 'Stylus compiled: %s -> %s' % (source, output))
+    def find_dependencies(self, source, content):
+        return follow_imports(source, content, self._import_regex, '.styl', self.paths)
+
+    def node_compile(self, source):
+        def _compile(content):
+            output, deps = get_worker().compile('stylus', content, source, {
+                'compress': self.compress,
+                'paths': self.paths,
+                'plugins': self.plugins,
+            })
+            self.compiler_deps.update(os.path.relpath(i) for i in deps)
+            return output
+        return _compile
+
+    def stylus(self, source, output):
+        if self.node_worker:
+            compile_func = self.node_compile(source)
+        else:
+            compile_func = self.compiler.compile
+        cached = self.compile_file(source, output, compile_func)
+        self.log(True, 'Stylus compiled%s: %s -> %s' % (cached and ' (cached)' or '', source, output))
 
 
 class JadeHandler(CompileHandler):
@@ -225,6 +579,12 @@ class JadeHandler(CompileHandler):
 
     template = 'tornado'
 
+    # render with node's jade in the long-lived node worker instead of pyjade,
+    # `template` does not apply then
+    node_worker = False
+
+    pretty = False
+
     _support_templates = ['django', 'jinja', 'mako', 'tornado']
 
     @classmethod
@@ -241,9 +601,25 @@ class JadeHandler(CompileHandler):
             return process(s, compiler=template_compiler, staticAttrs=True, extension='.html')
         return _compiler
 
-    def jade(self, source, output):
-        self.mkdir(output)
+    @classmethod
+    def cache_options(cls):
+        return cls.template, cls.node_worker, cls.pretty
+
+    _include_regex = re.compile(r'^\s*(?:include|extends)(?::[\w-]+)?\s+(\S+)', re.M)
+
+    def find_dependencies(self, source, content):
+        return follow_imports(source, content, self._include_regex, '.jade')
 
-        self.write_file(output,
-                        self.compiler(self.read_file(source)))
-        self.log(True, 'Jade compiled: %s -> %s' % (source, output))
+    def node_compile(self, source):
+        def _compile(content):
+            output, deps = get_worker().compile('jade', content, source, {'pretty': self.pretty})
+            return output
+        return _compile
+
+    def jade(self, source, output):
+        if self.node_worker:
+            compile_func = self.node_compile(source)
+        else:
+            compile_func = self.compiler
+        cached = self.compile_file(source, output, compile_func)
+        self.log(True, 'Jade compiled%s: %s -> %s' % (cached and ' (cached)' or '', source, output))
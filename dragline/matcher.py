@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import fnmatch
+
+
+def translate(pattern):
+    """
+    `fnmatch.translate` without the end anchor and flags, so that
+    several patterns could be joined into one regex
+    """
+    res = fnmatch.translate(pattern)
+    if res.endswith('\\Z(?ms)'):
+        # python 2
+        return res[:-len('\\Z(?ms)')]
+    if res.startswith('(?s:') and res.endswith(')\\Z'):
+        # python 3
+        return res[len('(?s:'):-len(')\\Z')]
+    return res
+
+
+_magic_regex = re.compile('[*?[]')
+
+
+def literal_prefix(pattern):
+    """
+    The directory part of `pattern` before its first wildcard, every path
+    that matches `pattern` is under it
+
+    ('assets/css/*.styl') 'assets/css'
+    ('assets/a?.styl') 'assets'
+    ('*.styl') ''
+    """
+    m = _magic_regex.search(pattern)
+    if m:
+        pattern = pattern[:m.start()]
+        return pattern[:pattern.rfind('/') + 1].rstrip('/')
+    return pattern.rpartition('/')[0]
+
+
+def is_suffix_pattern(pattern):
+    """
+    Whether `pattern` is a `*` followed by a literal, which matches the
+    paths that end with the literal since `*` also matches '/'
+
+    ('*.styl') True
+    ('*.sw?') False
+    ('src/*.styl') False
+    """
+    return len(pattern) > 1 and pattern[0] == '*' and not _magic_regex.search(pattern[1:])
+
+
+class PatternMatcher(object):
+    """
+    Match a path against a list of fnmatch patterns at once.
+
+    The patterns are compiled into combined regexes, one group for each pattern,
+    so the first pattern that matches is known from `lastindex` without trying
+    the patterns one by one.
+
+    When every pattern is a `*` followed by a literal, like '*.styl', the
+    result only depends on the end of the path, and it is cached by that end;
+    a walk visits more paths than any per-path cache could keep, but few
+    distinct endings.
+    """
+    # python 2 `re` supports no more than 100 groups in one regex
+    chunk_size = 90
+
+    cache_limit = 100000
+
+    def __init__(self, patterns, cache_limit=None):
+        if cache_limit is not None:
+            self.cache_limit = cache_limit
+        self.patterns = list(patterns)
+        self._regexes = []
+        for start in xrange(0, len(self.patterns), self.chunk_size):
+            chunk = self.patterns[start:start + self.chunk_size]
+            regex = re.compile(
+                '(?ms)(?:%s)\\Z' % '|'.join('(%s)' % translate(i) for i in chunk))
+            self._regexes.append((start, regex))
+        self._cache = {}
+        # length of the path endings results are cached by, None for no cache
+        self._suffix_len = None
+        if self.patterns and all(is_suffix_pattern(i) for i in self.patterns):
+            self._suffix_len = max(len(i) for i in self.patterns) - 1
+
+    def match(self, path):
+        """
+        Return the index of the first pattern that matches `path`, or None
+        """
+        if self._suffix_len is None or not self.cache_limit:
+            return self._match(path)
+        key = path[-self._suffix_len:]
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        rv = self._match(path)
+        if len(self._cache) >= self.cache_limit:
+            self._cache.clear()
+        self._cache[key] = rv
+        return rv
+
+    def _match(self, path):
+        for start, regex in self._regexes:
+            m = regex.match(path)
+            if m:
+                return start + m.lastindex - 1
+        return None
+
+    def matches(self, path):
+        return self.match(path) is not None
+
+
+def expand_globstar(pattern):
+    """
+    fnmatch's `*` already crosses directories, `**/` is expanded so that it
+    also matches no directory at all
+
+    ('a/**/*.jade') ['a/*.jade', 'a/*/*.jade']
+    """
+    head, sep, tail = pattern.partition('**/')
+    if not sep:
+        return [pattern]
+    rv = []
+    for i in expand_globstar(tail):
+        rv.append(head + i)
+        rv.append(head + '*/' + i)
+    return rv
+
+
+class AllowList(object):
+    """
+    Watch rules compiled into the directories they are under and a matcher,
+    so that a walk could skip the directories that can not contain a match.
+
+    'assets/' watches everything under assets, other rules are fnmatch
+    patterns of files, e.g. 'src/*.styl', 'templates/**/*.jade'
+    """
+    def __init__(self, rules):
+        patterns = []
+        self.prefixes = set()
+        for i in rules:
+            if i.endswith('/'):
+                i = i + '*'
+            for pattern in expand_globstar(i):
+                patterns.append(pattern)
+                self.prefixes.add(literal_prefix(pattern))
+        self.matcher = PatternMatcher(patterns)
+
+        # a rule like '*.styl' could match anywhere
+        self.anywhere = '' in self.prefixes
+        self.ancestors = set()
+        for i in self.prefixes:
+            while i:
+                i = i.rpartition('/')[0]
+                self.ancestors.add(i)
+
+    def matches(self, path):
+        return self.matcher.matches(path)
+
+    def may_contain(self, dirpath):
+        """
+        Whether a file under `dirpath` could match, `dirpath` is relative
+        """
+        if self.anywhere or dirpath in self.prefixes or dirpath in self.ancestors:
+            return True
+        while dirpath:
+            dirpath = dirpath.rpartition('/')[0]
+            if dirpath in self.prefixes:
+                return True
+        return False
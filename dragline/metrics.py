@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import threading
+from collections import deque
+
+
+class Stats(object):
+    """
+    Count, total and max of named timings, in seconds, and named counters.
+
+    The last `window` samples of each timing are kept, so that the mean and
+    95th percentile of the recent ones could be told from the overall ones.
+    """
+    window = 200
+
+    def __init__(self, window=None):
+        if window is not None:
+            self.window = window
+        self.lock = threading.Lock()
+        self.timings = {}  # name -> [count, total, max, deque of recent samples]
+        self.counters = {}  # name -> int
+
+    def add(self, name, seconds):
+        with self.lock:
+            t = self.timings.get(name)
+            if t is None:
+                self.timings[name] = [1, seconds, seconds, deque([seconds], self.window)]
+            else:
+                t[0] += 1
+                t[1] += seconds
+                if seconds > t[2]:
+                    t[2] = seconds
+                t[3].append(seconds)
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def count(self, name):
+        return self.counters.get(name, 0)
+
+    def get_counters(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def get(self, name):
+        """
+        Return a dict of count, total, mean and max of `name`, and the mean and
+        95th percentile of its recent samples, or None
+        """
+        with self.lock:
+            t = self.timings.get(name)
+            if t is None:
+                return None
+            count, total, max_, recent = t
+            recent = sorted(recent)
+        return {
+            'count': count,
+            'total': total,
+            'mean': total / count,
+            'max': max_,
+            'recent_mean': sum(recent) / len(recent),
+            'recent_p95': recent[int(len(recent) * 0.95)],
+        }
+
+    def summary(self):
+        with self.lock:
+            names = list(self.timings)
+        return dict((name, self.get(name)) for name in names)
+
+    def dump(self):
+        """
+        A plain copy of the stats, to be sent from a worker process and `merge`d
+        """
+        with self.lock:
+            return {
+                'timings': dict((k, v[:3] + [list(v[3])]) for k, v in self.timings.iteritems()),
+                'counters': dict(self.counters),
+            }
+
+    def merge(self, data):
+        for name, (count, total, max_, recent) in data['timings'].iteritems():
+            with self.lock:
+                t = self.timings.get(name)
+                if t is None:
+                    self.timings[name] = [count, total, max_, deque(recent, self.window)]
+                else:
+                    t[0] += count
+                    t[1] += total
+                    t[2] = max(t[2], max_)
+                    t[3].extend(recent)
+        for name, n in data['counters'].iteritems():
+            self.incr(name, n)
+
+    def format(self):
+        lines = []
+        for name, t in self.summary().iteritems():
+            lines.append('%s: %s times, mean %.2fms, recent %.2fms, p95 %.2fms, max %.2fms' % (
+                name, t['count'], t['mean'] * 1000, t['recent_mean'] * 1000,
+                t['recent_p95'] * 1000, t['max'] * 1000))
+        for name, n in self.get_counters().iteritems():
+            lines.append('%s: %s' % (name, n))
+        return '\n'.join(sorted(lines))
+
+
+class Profiler(object):
+    """
+    cProfile of the thread that calls `start`, each session is written to
+    `directory` when it stops, and its top functions are logged
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.profile = None
+        self.sessions = 0
+
+    @property
+    def active(self):
+        return self.profile is not None
+
+    def start(self):
+        import cProfile
+
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            logging.info('profiling started')
+
+    def stop(self):
+        """
+        Stop profiling, return the path the profile is written to
+        """
+        import pstats
+
+        if self.profile is None:
+            return None
+        self.profile.disable()
+        profile, self.profile = self.profile, None
+
+        self.sessions += 1
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, 'profile-%s-%s.prof' % (os.getpid(), self.sessions))
+        profile.dump_stats(path)
+
+        from cStringIO import StringIO
+        out = StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(20)
+        logging.info('profile written to %s\n%s' % (path, out.getvalue()))
+        return path
+
+    def toggle(self):
+        if self.active:
+            self.stop()
+        else:
+            self.start()
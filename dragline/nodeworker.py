@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A long-lived node process that compiles stylus and jade sources,
+# so that a rebuild pays node's startup once instead of once per file.
+#
+# Requests and responses are JSON lines over stdin/stdout:
+#
+#     -> {"id": 1, "compiler": "stylus", "source": "...", "filename": "...", "options": {}}
+#     <- {"id": 1, "output": "...", "deps": [...]} or {"id": 1, "error": "..."}
+
+import json
+import atexit
+import logging
+import itertools
+import threading
+import subprocess as sp
+
+
+_SCRIPT = r"""
+var readline = require('readline');
+
+function reply(id, err, output, deps) {
+    var rv = {id: id};
+    if (err) {
+        rv.error = String(err && err.message || err);
+    } else {
+        rv.output = output;
+        rv.deps = deps || [];
+    }
+    process.stdout.write(JSON.stringify(rv) + '\n');
+}
+
+var compilers = {
+    stylus: function (req, done) {
+        var o = req.options || {},
+            style = require('stylus')(req.source)
+                .set('filename', req.filename)
+                .set('compress', !!o.compress)
+                .set('paths', o.paths || []);
+        (o.plugins || []).forEach(function (name) {
+            style.use(require(name)());
+        });
+        style.render(function (err, css) {
+            done(err, css, err ? [] : (style.deps ? style.deps() : []));
+        });
+    },
+    jade: function (req, done) {
+        var o = req.options || {};
+        done(null, require('jade').render(req.source, {filename: req.filename, pretty: !!o.pretty}));
+    }
+};
+
+readline.createInterface({input: process.stdin, terminal: false}).on('line', function (line) {
+    var req;
+    if (!line) return;
+    try {
+        req = JSON.parse(line);
+    } catch (e) {
+        return;
+    }
+    if (!compilers[req.compiler]) return reply(req.id, 'unknown compiler ' + req.compiler);
+    try {
+        compilers[req.compiler](req, function (err, output, deps) {
+            reply(req.id, err, output, deps);
+        });
+    } catch (e) {
+        reply(req.id, e);
+    }
+});
+"""
+
+
+class NodeCompileError(Exception):
+    pass
+
+
+class NodeWorker(object):
+    """
+    Keep one node process to compile with, it is started on first use
+    and started again if it died
+    """
+    def __init__(self, node='node'):
+        self.node = node
+        self.p = None
+        self.starts = 0
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def start(self):
+        self.p = sp.Popen([self.node, '-e', _SCRIPT], stdin=sp.PIPE, stdout=sp.PIPE, close_fds=True)
+        self.starts += 1
+        logging.debug('node worker started, pid %s' % self.p.pid)
+
+    def alive(self):
+        return self.p is not None and self.p.poll() is None
+
+    def close(self):
+        if self.p is None:
+            return
+        try:
+            self.p.stdin.close()
+            if self.p.poll() is None:
+                self.p.terminate()
+            self.p.wait()
+        except (OSError, IOError):
+            pass
+        self.p = None
+
+    def compile_batch(self, requests):
+        """
+        `requests` is a list of (compiler, source, filename, options),
+        return a list of response dicts in the same order
+        """
+        with self.lock:
+            try:
+                return self._communicate(requests)
+            except (IOError, OSError, ValueError, EOFError), e:
+                logging.warning('node worker failed (%s), restarting it' % e)
+                self.close()
+                return self._communicate(requests)
+
+    def compile(self, compiler, source, filename, options=None):
+        """
+        Compile one source, return (output, deps)
+        """
+        rv = self.compile_batch([(compiler, source, filename, options or {})])[0]
+        if 'error' in rv:
+            raise NodeCompileError('%s: %s' % (filename, rv['error']))
+        return rv['output'], rv['deps']
+
+    def _communicate(self, requests):
+        if not self.alive():
+            self.start()
+
+        ids = []
+        lines = []
+        for compiler, source, filename, options in requests:
+            i = self._ids.next()
+            ids.append(i)
+            lines.append(json.dumps({
+                'id': i,
+                'compiler': compiler,
+                'source': source,
+                'filename': filename,
+                'options': options,
+            }) + '\n')
+
+        # write from another thread, node could fill up stdout before
+        # it has read a big batch
+        errors = []
+
+        def write():
+            try:
+                self.p.stdin.write(''.join(lines))
+                self.p.stdin.flush()
+            except (IOError, OSError), e:
+                errors.append(e)
+
+        writer = threading.Thread(target=write)
+        writer.daemon = True
+        writer.start()
+
+        results = {}
+        while len(results) < len(ids):
+            line = self.p.stdout.readline()
+            if not line:
+                writer.join()
+                raise EOFError('node worker exited with %s' % self.p.poll())
+            rv = json.loads(line)
+            results[rv['id']] = rv
+        writer.join()
+        if errors:
+            raise errors[0]
+
+        return [results[i] for i in ids]
+
+
+_worker = None
+
+
+def get_worker():
+    """
+    The node worker of the current process
+    """
+    global _worker
+    if _worker is None:
+        _worker = NodeWorker()
+        atexit.register(_worker.close)
+    return _worker
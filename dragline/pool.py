@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import heapq
+import signal
+import logging
+import threading
+import itertools
+import multiprocessing
+from collections import deque
+
+from .metrics import Stats
+
+
+class DraglineProxy(object):
+    """
+    Stands for the Dragline instance in a worker process,
+    carries only what handlers read from it
+    """
+    def __init__(self, debug, root='.'):
+        self.debug = debug
+        self.root = root
+        self.dependencies = []
+        self.stats = Stats()
+
+    def report_exit(self, cmd, returncode):
+        self.stats.incr('exit.%s' % returncode)
+
+    def report_dependencies(self, source, deps):
+        self.dependencies.append((source, deps))
+
+
+class HandlerCancelled(Exception):
+    pass
+
+
+class Task(object):
+    """
+    A running task, handlers attach the processes they start to it so that
+    the task could be cancelled by killing them
+    """
+    def __init__(self, key):
+        self.key = key
+        self.cancelled = False
+        self.processes = []
+        self.lock = threading.Lock()
+
+    def attach(self, p):
+        with self.lock:
+            self.processes.append(p)
+            if self.cancelled:
+                _kill(p)
+
+    def detach(self, p):
+        with self.lock:
+            if p in self.processes:
+                self.processes.remove(p)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            for p in self.processes:
+                _kill(p)
+
+    def check(self):
+        if self.cancelled:
+            raise HandlerCancelled('%s superseded' % (self.key, ))
+
+
+def _kill(p):
+    try:
+        if p.poll() is None:
+            p.terminate()
+    except OSError:
+        pass
+
+
+_local = threading.local()
+
+
+def current_task():
+    """
+    The task the current thread is running, None outside of a `HandlerPool`
+    """
+    return getattr(_local, 'task', None)
+
+
+def _init_process():
+    # Ctrl-C is handled by the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_in_process(hdr, status, debug, root, args):
+    proxy = DraglineProxy(debug, root)
+    t0 = time.time()
+    hdr_instance = hdr(proxy, *args)
+    setup_time = time.time() - t0
+    getattr(hdr_instance, status)()
+    return setup_time, proxy.dependencies, proxy.stats.dump()
+
+
+class HandlerPool(object):
+    """
+    Run tasks on `workers` threads. Tasks submitted with the same key, which is
+    the file path for handlers, run one at a time in submission order, tasks of
+    different keys run concurrently.
+
+    Handler classes with `in_process` set are run in a process pool of the same
+    size, which is created on first use.
+
+    If `max_pending` is set, `submit` blocks while that many tasks are waiting.
+
+    `supersede` is what `submit_latest` does when the key already has a task:
+    'queue' runs the new one after it, 'cancel' drops the pending ones and
+    cancels the running one, 'ignore' drops the new one.
+
+    Keys that are ready to run are taken by `priority`, higher first, then
+    non-`bulk` before `bulk`, then in submission order. A key ranks as its
+    most urgent pending task, since the tasks before it have to run first.
+    At most `limit` tasks of one `group` run at the same time.
+    """
+    def __init__(self, workers, max_pending=None, supersede='queue'):
+        if not supersede in ('queue', 'cancel', 'ignore'):
+            raise Exception('supersede should be one of queue, cancel, ignore')
+        self.workers = workers
+        self.max_pending = max_pending
+        self.supersede = supersede
+        self.cond = threading.Condition()
+        self.pending = {}  # key -> deque of (func, args, rank, group)
+        self.npending = 0
+        # heap of [rank, key] of the keys that have pending tasks and none
+        # running, an entry whose key is None was replaced by a better one
+        self.ready = []
+        self.queued = {}  # key -> its entry in `ready`
+        self.blocked = {}  # group -> entries held back by the limit of the group
+        self.running = {}  # key -> Task
+        self.limits = {}  # group -> max running tasks
+        self.groups = {}  # group -> [pending, running]
+        self.superseded = 0
+        self._seq = itertools.count()
+        self.closed = False
+        self._processes = None
+
+        self.threads = []
+        for i in xrange(workers):
+            t = threading.Thread(target=self._work, name='dragline-worker-%s' % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, key, func, *args, **options):
+        """
+        Run `func(*args)` after the tasks `key` already has, `options` are
+        `priority` (0), `bulk` (False), `group` (None) and `limit` (None),
+        the max running tasks of the group
+        """
+        priority = options.pop('priority', 0)
+        bulk = options.pop('bulk', False)
+        group = options.pop('group', None)
+        limit = options.pop('limit', None)
+        with self.cond:
+            while self.max_pending and self.npending >= self.max_pending and not self.closed:
+                self.cond.wait(0.1)
+            if self.closed:
+                return
+            rank = (-priority, bulk, next(self._seq))
+            if limit:
+                self.limits[group] = limit
+            tasks = self.pending.setdefault(key, deque())
+            tasks.append((func, args, rank, group))
+            self.npending += 1
+            self.groups.setdefault(group, [0, 0])[0] += 1
+            if not key in self.running:
+                self._queue(key, rank)
+
+    def submit_latest(self, key, func, *args, **options):
+        """
+        `submit`, resolving a task that `key` already has by `supersede`
+        """
+        if self.supersede != 'queue':
+            with self.cond:
+                tasks = self.pending.get(key)
+                if self.supersede == 'ignore':
+                    if tasks or key in self.running:
+                        self.superseded += 1
+                        return
+                else:
+                    if key in self.running:
+                        self.running[key].cancel()
+                        self.superseded += 1
+                    if tasks:
+                        # dropped, the new task takes the place of the waiting ones
+                        self.superseded += len(tasks)
+                        self.npending -= len(tasks)
+                        for i in tasks:
+                            self.groups[i[3]][0] -= 1
+                        tasks.clear()
+                        # the key ranked as the dropped tasks, the new one queues it again
+                        entry = self.queued.pop(key, None)
+                        if entry is not None:
+                            entry[1] = None
+        self.submit(key, func, *args, **options)
+
+    def _queue(self, key, rank):
+        """
+        Make `key` ready with `rank`, unless it is ready with a better one
+        """
+        entry = self.queued.get(key)
+        if entry is not None:
+            if entry[0] <= rank:
+                return
+            entry[1] = None
+        entry = self.queued[key] = [rank, key]
+        heapq.heappush(self.ready, entry)
+        self.cond.notify()
+
+    def _requeue(self, key):
+        """
+        Make `key` ready again after its running task, if it has pending ones
+        """
+        tasks = self.pending.get(key)
+        if tasks:
+            self._queue(key, min(i[2] for i in tasks))
+        else:
+            self.pending.pop(key, None)
+
+    def _take(self):
+        """
+        Pop the most urgent ready key whose group is under its limit, or None
+        """
+        while self.ready:
+            entry = heapq.heappop(self.ready)
+            key = entry[1]
+            if key is None:
+                continue
+            tasks = self.pending.get(key)
+            if not tasks:
+                # its tasks were superseded, a new one queues it again
+                del self.queued[key]
+                self.pending.pop(key, None)
+                continue
+            group = tasks[0][3]
+            limit = self.limits.get(group)
+            if limit and self.groups[group][1] >= limit:
+                self.blocked.setdefault(group, []).append(entry)
+                continue
+            del self.queued[key]
+            return key
+        return None
+
+    def depth(self):
+        with self.cond:
+            return {
+                'pending': self.npending,
+                'running': len(self.running),
+                'superseded': self.superseded,
+                'groups': dict((str(group), {'pending': n[0], 'running': n[1]})
+                               for group, n in self.groups.iteritems() if n[0] or n[1]),
+            }
+
+    def run_handler(self, hdr, status, debug, root, args):
+        """
+        Run a handler class in the process pool, block until it finishes,
+        return the time spent on instantiating the handler, the
+        dependencies it reported and the dump of its stats
+        """
+        with self.cond:
+            if self._processes is None:
+                self._processes = multiprocessing.Pool(self.workers, _init_process)
+            processes = self._processes
+        return processes.apply(_run_in_process, (hdr, status, debug, root, args))
+
+    def _work(self):
+        while True:
+            with self.cond:
+                key = None
+                while not self.closed:
+                    key = self._take()
+                    if key is not None:
+                        break
+                    self.cond.wait()
+                if self.closed:
+                    return
+                func, args, rank, group = self.pending[key].popleft()
+                self.npending -= 1
+                counts = self.groups[group]
+                counts[0] -= 1
+                counts[1] += 1
+                task = self.running[key] = Task(key)
+                self.cond.notify_all()
+
+            _local.task = task
+            try:
+                func(*args)
+            except HandlerCancelled, e:
+                logging.info('%s, output discarded' % e)
+            except Exception:
+                logging.exception('Handler failed on %s' % (key, ))
+            finally:
+                _local.task = None
+                with self.cond:
+                    del self.running[key]
+                    counts[1] -= 1
+                    # the keys held back by the limit of the group could run now
+                    for entry in self.blocked.pop(group, []):
+                        heapq.heappush(self.ready, entry)
+                    self._requeue(key)
+                    self.cond.notify_all()
+
+    def join(self):
+        """
+        Wait until all submitted tasks are done
+        """
+        with self.cond:
+            while self.pending or self.running:
+                # a timeout keeps the main thread interruptible by Ctrl-C
+                self.cond.wait(0.1)
+
+    def shutdown(self, wait=True):
+        """
+        Drop pending tasks, and wait for the running ones if `wait`
+        """
+        with self.cond:
+            self.closed = True
+            self.pending.clear()
+            self.npending = 0
+            del self.ready[:]
+            self.queued.clear()
+            self.blocked.clear()
+            self.groups.clear()
+            self.cond.notify_all()
+        if wait:
+            for t in self.threads:
+                while t.is_alive():
+                    t.join(0.1)
+        if self._processes is not None:
+            self._processes.terminate()
+            self._processes = None
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from array import array
+
+
+class Record(object):
+    """
+    Snapshot of the watched files, replaces the old `{path: mtime}` dict.
+
+    Paths are interned and map to a row, stat fields are kept in parallel
+    `array` columns, so a snapshot of a big tree costs a few bytes per file
+    instead of a float object each. Rows of removed paths are recycled.
+
+    `update` diffs in place: every row seen in a walk is stamped with the
+    walk's generation, removed paths are the rows left with an older stamp,
+    which only has to be looked for when fewer rows than known were seen.
+    """
+    def __init__(self):
+        self.index = {}  # path -> row
+        self.paths = []  # row -> path, None for a free row
+        self.mtimes = array('d')
+        self.sizes = array('l')
+        self.stamps = array('L')
+        self.generation = 0
+        self._free = []
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def get(self, path, default=None):
+        row = self.index.get(path)
+        if row is None:
+            return default
+        return self.mtimes[row], self.sizes[row]
+
+    def set(self, path, mtime, size):
+        """
+        Store the stat of `path`, return 'added', 'modified' or None if nothing changed
+        """
+        row = self.index.get(path)
+        if row is None:
+            self._insert(intern(path), mtime, size)
+            return 'added'
+        if self.mtimes[row] != mtime or self.sizes[row] != size:
+            self.mtimes[row] = mtime
+            self.sizes[row] = size
+            return 'modified'
+        return None
+
+    def remove(self, path):
+        row = self.index.pop(path, None)
+        if row is None:
+            return False
+        self.paths[row] = None
+        self._free.append(row)
+        return True
+
+    def update(self, stats):
+        """
+        Diff the snapshot against `stats`, an iterable of (path, mtime, size)
+        covering the whole tree, and apply the result in place.
+
+        Return the changes dict, paths missing from `stats` are removed
+        """
+        self.generation += 1
+        generation = self.generation
+        index = self.index
+        mtimes = self.mtimes
+        sizes = self.sizes
+        stamps = self.stamps
+        known = len(index)
+        seen = 0
+        new = []
+        modified = []
+
+        # a walk yields each path once, so counting stamped rows is enough
+        for stat in stats:
+            path, mtime, size = stat
+            row = index.get(path)
+            if row is None:
+                new.append(stat)
+                continue
+            stamps[row] = generation
+            seen += 1
+            if mtimes[row] != mtime or sizes[row] != size:
+                mtimes[row] = mtime
+                sizes[row] = size
+                modified.append(path)
+
+        if seen < known:
+            removed = [path for path, row in index.iteritems() if stamps[row] != generation]
+            for path in removed:
+                self.remove(path)
+        else:
+            removed = []
+
+        added = []
+        for path, mtime, size in new:
+            if path in index:
+                continue
+            path = intern(path)
+            self._insert(path, mtime, size)
+            added.append(path)
+
+        return {
+            'added': added,
+            'modified': modified,
+            'removed': removed
+        }
+
+    def _insert(self, path, mtime, size):
+        if self._free:
+            row = self._free.pop()
+            self.paths[row] = path
+            self.mtimes[row] = mtime
+            self.sizes[row] = size
+            self.stamps[row] = self.generation
+        else:
+            row = len(self.paths)
+            self.paths.append(path)
+            self.mtimes.append(mtime)
+            self.sizes.append(size)
+            self.stamps.append(self.generation)
+        self.index[path] = row
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def list_dir(dirpath):
+    """
+    List `dirpath`, return (dirnames, links, filenames, entries): `links` are
+    the dirnames that are symbolic links, which are not descended into like
+    `os.walk` does, `filenames` are the regular files and links to them.
+
+    With scandir the types come from the directory listing, and `entries` are
+    the `DirEntry`s of `filenames`, whose `stat()` is cached; without it each
+    name costs a stat and `entries` is None.
+    """
+    dirnames = []
+    links = set()
+    filenames = []
+    if scandir is None:
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            if os.path.isdir(path):
+                dirnames.append(name)
+                if os.path.islink(path):
+                    links.add(name)
+            elif os.path.isfile(path):
+                filenames.append(name)
+        return dirnames, links, filenames, None
+
+    entries = []
+    for entry in scandir(dirpath):
+        try:
+            if entry.is_dir():
+                dirnames.append(entry.name)
+                if entry.is_symlink():
+                    links.add(entry.name)
+            elif entry.is_file():
+                filenames.append(entry.name)
+                entries.append(entry)
+        except OSError:
+            # removed meanwhile
+            continue
+    return dirnames, links, filenames, entries
+
+
+class IncrementalScanner(object):
+    """
+    A replacement of `os.walk` for the polling loop that keeps state between walks:
+
+        dirpath -> (dir mtime, dirnames, filenames, filepaths)
+        filepath -> (mtime, size)
+
+    A directory is listed again only when its mtime changed, which is the case
+    whenever an entry is added, removed or renamed in it. Files in a relisted
+    directory are stat'ed again; the others are re-stat'ed `restat_batch` at a time
+    in rotation, or all of them on every walk if `restat_batch` is 0, since
+    writing into an existing file does not touch the mtime of its directory.
+    """
+    def __init__(self, react, recursive=True, restat_batch=0, root='.'):
+        self.react = react
+        self.root = root
+        self.recursive = recursive
+        self.restat_batch = restat_batch
+
+        self.dirs = {}
+        self.stats = {}
+        self._due = set()
+        self._rotation = []
+        self._rotation_dirty = True
+        self._cursor = 0
+
+    def walk(self, top=None):
+        """
+        Yield the same (dirpath, dirnames, filenames, filepaths) tuples as
+        the `react` function yields for `os.walk`
+        """
+        if top is None:
+            top = self.root
+        visited = set()
+        relisted = 0
+        stack = [top]
+        while stack:
+            dirpath = stack.pop()
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            visited.add(dirpath)
+
+            cached = self.dirs.get(dirpath)
+            if cached is None or cached[0] != mtime:
+                cached = self._list(dirpath, mtime)
+                if cached is None:
+                    continue
+                relisted += 1
+
+            mtime, dirnames, filenames, filepaths = cached
+            yield dirpath, dirnames, filenames, filepaths
+
+            if not self.recursive:
+                break
+            for i in reversed(dirnames):
+                subpath = os.path.join(dirpath, i)
+                if not os.path.islink(subpath):
+                    stack.append(subpath)
+
+        if top == self.root:
+            self._purge(visited)
+        self._schedule()
+        logging.debug('scanner: %s dirs visited, %s relisted' % (len(visited), relisted))
+
+    def invalidate(self, top):
+        """
+        List `top` and the directories under it again on the next walk,
+        e.g. after what is ignored in them changed
+        """
+        top = os.path.normpath(top)
+        prefix = top + '/'
+        for dirpath, cached in self.dirs.items():
+            path = os.path.normpath(dirpath)
+            if top == '.' or path == top or path.startswith(prefix):
+                self.dirs[dirpath] = (None, ) + cached[1:]
+
+    def get_stat(self, filepath):
+        if self.restat_batch and filepath in self.stats and not filepath in self._due:
+            return self.stats[filepath]
+        st = os.stat(filepath)
+        self.stats[filepath] = st.st_mtime, st.st_size
+        self._due.discard(filepath)
+        return self.stats[filepath]
+
+    def _list(self, dirpath, mtime):
+        try:
+            dirnames, links, filenames, entries = list_dir(dirpath)
+        except OSError:
+            return None
+
+        dirpath, dirnames, filenames, filepaths = self.react(dirpath, dirnames, filenames)
+
+        old = self.dirs.get(dirpath)
+        if old:
+            for i in set(old[3]) - set(filepaths):
+                self.stats.pop(i, None)
+        self._due.update(filepaths)
+        self._rotation_dirty = True
+
+        cached = (mtime, dirnames, filenames, filepaths)
+        self.dirs[dirpath] = cached
+        return cached
+
+    def _purge(self, visited):
+        for dirpath in [i for i in self.dirs if not i in visited]:
+            for i in self.dirs.pop(dirpath)[3]:
+                self.stats.pop(i, None)
+                self._due.discard(i)
+            self._rotation_dirty = True
+
+    def _schedule(self):
+        """
+        Mark the next `restat_batch` files of the rotation as due
+        """
+        if not self.restat_batch:
+            return
+        if self._rotation_dirty:
+            self._rotation = list(self.stats)
+            self._rotation_dirty = False
+        if not self._rotation:
+            return
+        if self._cursor >= len(self._rotation):
+            self._cursor = 0
+        batch = self._rotation[self._cursor:self._cursor + self.restat_batch]
+        self._cursor += self.restat_batch
+        self._due.update(batch)
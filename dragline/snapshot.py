@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# On-disk snapshot of a `Record`, the layout is:
+#
+#     header   magic, version, mtime itemsize, size itemsize, count
+#     mtimes   count * array('d')
+#     sizes    count * array('l')
+#     paths    '\0' joined
+
+import os
+import struct
+import logging
+from array import array
+
+from .record import Record
+
+
+MAGIC = 'DRGL'
+
+VERSION = 1
+
+_header = struct.Struct('<4sBBBI')
+
+
+def save_record(record, path):
+    """
+    Write `record` to `path`, the file is replaced atomically
+    """
+    paths = []
+    mtimes = array('d')
+    sizes = array('l')
+    for filepath, row in record.index.iteritems():
+        paths.append(filepath)
+        mtimes.append(record.mtimes[row])
+        sizes.append(record.sizes[row])
+
+    dirpath = os.path.dirname(path)
+    if dirpath and not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(_header.pack(MAGIC, VERSION, mtimes.itemsize, sizes.itemsize, len(paths)))
+        mtimes.tofile(f)
+        sizes.tofile(f)
+        f.write('\0'.join(paths))
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+    logging.debug('snapshot of %s files saved to %s' % (len(paths), path))
+
+
+def load_record(path):
+    """
+    Read a record saved by `save_record`, return None if there is no
+    usable snapshot at `path`
+    """
+    if not os.path.exists(path):
+        return None
+
+    record = Record()
+    f = open(path, 'rb')
+    try:
+        header = f.read(_header.size)
+        if len(header) != _header.size:
+            return None
+        magic, version, mtime_size, size_size, count = _header.unpack(header)
+        if (magic != MAGIC or version != VERSION or
+                mtime_size != record.mtimes.itemsize or size_size != record.sizes.itemsize):
+            logging.warning('snapshot %s is not compatible, ignored' % path)
+            return None
+        try:
+            record.mtimes.fromfile(f, count)
+            record.sizes.fromfile(f, count)
+        except EOFError:
+            logging.warning('snapshot %s is truncated, ignored' % path)
+            return None
+        data = f.read()
+    finally:
+        f.close()
+
+    if count:
+        record.paths = [intern(i) for i in data.split('\0')]
+    if len(record.paths) != count:
+        logging.warning('snapshot %s is corrupted, ignored' % path)
+        return None
+    record.stamps = array('L', [0]) * count
+    record.index = dict((p, row) for row, p in enumerate(record.paths))
+    logging.debug('snapshot of %s files loaded from %s' % (count, path))
+    return record
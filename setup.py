@@ -45,6 +45,8 @@ setup(
         ]
     },
     install_requires=[
-        'termcolor'
+        'termcolor',
+        # os.scandir of python 3, lets the walk stat each file once
+        'scandir'
     ]
 )
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+
+from dragline.core import Dragline, wait_for
+
+
+class ControlWakeTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp(prefix='dragline-test-')
+        os.chdir(self.root)
+        self.drag = Dragline(backend='polling', interval=5000, workers=0,
+                             control='unix:control.sock')
+        self.drag.setup()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.start()
+
+    def tearDown(self):
+        self.stopped = True
+        self.drag.control_server._wake()
+        self.thread.join()
+        self.drag.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def loop(self):
+        while not self.stopped:
+            wait_for([self.drag], self.drag.wait_time())
+            self.drag.tick()
+
+    def request(self, method, path):
+        s = socket.socket(socket.AF_UNIX)
+        s.connect('control.sock')
+        s.sendall('%s %s HTTP/1.0\r\n\r\n' % (method, path))
+        data = ''
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        s.close()
+        return json.loads(data.split('\r\n\r\n', 1)[1])
+
+    def test_commands_do_not_wait_for_the_poll(self):
+        # let the loop go to sleep until its next poll
+        time.sleep(0.2)
+        for method, path in (('GET', '/status'), ('POST', '/pause'), ('POST', '/resume')):
+            t0 = time.time()
+            rv = self.request(method, path)
+            self.assertTrue(time.time() - t0 < 1, (path, time.time() - t0))
+            self.assertTrue('paused' in rv)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dragline.core import Dragline
+
+
+handled = []
+
+
+def handler(dirpath, filename, filepath):
+    handled.append(filepath)
+
+
+class DigestSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp(prefix='dragline-test-')
+        os.chdir(self.root)
+        for i in ('a.txt', 'b.txt'):
+            f = open(i, 'w')
+            f.write(i)
+            f.close()
+        del handled[:]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def start(self):
+        drag = Dragline(handlers=[('*.txt', handler)], checksum=True, snapshot=True,
+                        backend='polling', workers=0)
+        drag.setup()
+        return drag
+
+    def test_touch_after_restart_is_dropped(self):
+        self.start().stop()
+        drag = self.start()
+        os.utime('a.txt', (1, 1))
+        f = open('b.txt', 'w')
+        f.write('changed')
+        f.close()
+        os.utime('b.txt', (2, 2))
+        drag._handle(drag.watcher.poll(0))
+        drag.stop()
+        self.assertEqual(handled, ['b.txt'])
+
+    def test_touch_while_stopped_is_dropped(self):
+        self.start().stop()
+        os.utime('a.txt', (1, 1))
+        self.start().stop()
+        self.assertEqual(handled, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
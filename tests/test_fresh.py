@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dragline.core import Dragline
+from dragline.handlers import CompileHandler
+
+
+compiled = []
+
+
+class UpperHandler(CompileHandler):
+    output_lreplace = ('src', 'out')
+    output_rreplace = ('.txt', '.out')
+    cache_size = 0
+
+    @classmethod
+    def get_compiler(cls):
+        return None
+
+    def added(self):
+        self.make()
+
+    def modified(self):
+        self.make()
+
+    def make(self):
+        compiled.append(self.filepath)
+        self.compile_file(self.filepath, self.output, lambda content: content.upper())
+
+
+class FreshTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp(prefix='dragline-test-')
+        os.chdir(self.root)
+        os.makedirs('src')
+        f = open('src/a.txt', 'w')
+        f.write('a')
+        f.close()
+        del compiled[:]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def trigger(self):
+        drag = Dragline(handlers=[('*.txt', UpperHandler)], workers=0)
+        drag.trigger('^', 'all')
+
+    def test_up_to_date_output_is_skipped(self):
+        self.trigger()
+        self.trigger()
+        self.assertEqual(compiled, ['src/a.txt'])
+
+    def test_unchanged_output_is_fresh_after_touch(self):
+        self.trigger()
+        # the source is newer, but compiles to the same output
+        os.utime('out/a.out', (1, 1))
+        self.trigger()
+        self.trigger()
+        self.assertEqual(compiled, ['src/a.txt', 'src/a.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
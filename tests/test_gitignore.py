@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from dragline.core import Dragline
+from dragline.backends import get_backend, inotify_available
+from dragline.gitignore import GitIgnore
+
+
+class IgnoreFileChangeTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp(prefix='dragline-test-')
+        os.chdir(self.root)
+        os.makedirs('build/sub')
+        self.write('.gitignore', 'build/\n')
+        self.write('a.txt', 'a')
+        self.write('build/sub/x.txt', 'x')
+        self.check_interval = GitIgnore.check_interval
+        GitIgnore.check_interval = 0
+
+    def tearDown(self):
+        GitIgnore.check_interval = self.check_interval
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, path, content, mtime=None):
+        f = open(path, 'w')
+        f.write(content)
+        f.close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def check(self, backend, scanner='full'):
+        drag = Dragline(gitignore=True, backend=backend, scanner=scanner, workers=0)
+        watcher = drag.watcher = get_backend(backend)(drag)
+        watcher.start()
+
+        def poll():
+            time.sleep(0.05)
+            changes = watcher.poll(0.1)
+            return dict((k, sorted(v)) for k, v in changes.iteritems() if v)
+
+        try:
+            self.write('.gitignore', '# nothing\n', 1000)
+            self.assertEqual(poll().get('added'), ['build/sub/x.txt'])
+            self.write('build/sub/x.txt', 'xx', 2000)
+            self.assertEqual(poll(), {'modified': ['build/sub/x.txt']})
+
+            self.write('.gitignore', 'build/\n', 3000)
+            self.assertEqual(poll().get('removed'), ['build/sub/x.txt'])
+            self.write('build/sub/x.txt', 'xxx', 4000)
+            self.assertEqual(poll(), {})
+        finally:
+            watcher.close()
+
+    def test_polling(self):
+        self.check('polling')
+
+    def test_polling_incremental(self):
+        self.check('polling', 'incremental')
+
+    @unittest.skipUnless(inotify_available(), 'inotify is not available')
+    def test_inotify(self):
+        self.check('inotify')
+
+
+if __name__ == '__main__':
+    unittest.main()
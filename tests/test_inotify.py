@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dragline.core import Dragline
+from dragline.backends import InotifyBackend, inotify_available
+
+
+@unittest.skipUnless(inotify_available(), 'inotify is not available')
+class InotifyTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp(prefix='dragline-test-')
+        os.chdir(self.root)
+        self.watcher = InotifyBackend(Dragline(workers=0))
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def poll(self):
+        return dict((k, sorted(v)) for k, v in self.watcher.poll(0.1).iteritems() if v)
+
+    def test_new_file_is_added_once_closed(self):
+        f = open('n.txt', 'w')
+        self.assertEqual(self.poll(), {})
+        f.write('content')
+        f.flush()
+        self.assertEqual(self.poll(), {})
+        f.close()
+        self.assertEqual(self.poll(), {'added': ['n.txt']})
+        self.assertEqual(self.poll(), {})
+
+    def test_many_new_files_are_added_once(self):
+        for i in xrange(200):
+            f = open('n%d.txt' % i, 'w')
+            f.write('content')
+            f.close()
+        changes = self.poll()
+        self.assertEqual(changes.keys(), ['added'])
+        self.assertEqual(len(changes['added']), 200)
+
+    def test_moved_in_file_is_added(self):
+        outside = tempfile.mkdtemp(prefix='dragline-test-')
+        try:
+            open(os.path.join(outside, 'm.txt'), 'w').close()
+            self.poll()
+            os.rename(os.path.join(outside, 'm.txt'), 'm.txt')
+            self.assertEqual(self.poll(), {'added': ['m.txt']})
+        finally:
+            shutil.rmtree(outside, ignore_errors=True)
+
+    def test_file_removed_before_close_is_not_reported(self):
+        f = open('t.txt', 'w')
+        os.remove('t.txt')
+        f.close()
+        self.assertEqual(self.poll(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import fnmatch
+import unittest
+
+from dragline.matcher import PatternMatcher, is_suffix_pattern
+
+
+PATHS = ['a.styl', 'dir/b.styl', 'dir/c.styl~', 'x.jade', 'deep/er/y.log', 'styl', '.styl', 'z.js']
+
+
+class PatternMatcherTest(unittest.TestCase):
+    def check(self, patterns):
+        matcher = PatternMatcher(patterns)
+        for n in xrange(2):
+            for path in PATHS:
+                expected = None
+                for i, pattern in enumerate(patterns):
+                    if fnmatch.fnmatchcase(path, pattern):
+                        expected = i
+                        break
+                self.assertEqual(matcher.match(path), expected, (patterns, path))
+        return matcher
+
+    def test_suffix_patterns_are_cached_by_ending(self):
+        matcher = self.check(['*.styl', '*~', '*.log'])
+        self.assertTrue(len(matcher._cache) <= len(PATHS))
+        self.assertFalse('dir/b.styl' in matcher._cache)
+
+    def test_other_patterns_are_not_cached(self):
+        matcher = self.check(['dir/*.styl', '*.jade', 'a.*'])
+        self.assertEqual(matcher._cache, {})
+
+    def test_is_suffix_pattern(self):
+        self.assertTrue(is_suffix_pattern('*.styl'))
+        self.assertTrue(is_suffix_pattern('*/build/out.txt'))
+        self.assertFalse(is_suffix_pattern('*'))
+        self.assertFalse(is_suffix_pattern('*.sw?'))
+        self.assertFalse(is_suffix_pattern('src/*.styl'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import unittest
+
+from dragline.core import Dragline, BURST_WINDOW
+from dragline.pool import HandlerPool, current_task
+
+
+class HandlerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.done = []
+        self.gate = threading.Event()
+
+    def tearDown(self):
+        self.gate.set()
+        self.pool.shutdown()
+
+    def make_pool(self, workers=1, **kwargs):
+        self.pool = HandlerPool(workers, **kwargs)
+        return self.pool
+
+    def block(self, key='blocker'):
+        """
+        Keep the only worker busy until `gate` is set, so that the tasks
+        submitted meanwhile are all pending when it is
+        """
+        started = threading.Event()
+
+        def func():
+            started.set()
+            self.gate.wait()
+        self.pool.submit(key, func)
+        started.wait()
+
+    def record(self, name):
+        self.done.append(name)
+
+    def run_all(self):
+        self.gate.set()
+        self.pool.join()
+        return self.done
+
+    def test_higher_priority_goes_first(self):
+        pool = self.make_pool()
+        self.block()
+        pool.submit('a', self.record, 'a')
+        pool.submit('b', self.record, 'b', priority=5)
+        pool.submit('c', self.record, 'c', priority=1)
+        pool.submit('d', self.record, 'd')
+        self.assertEqual(self.run_all(), ['b', 'c', 'a', 'd'])
+
+    def test_interactive_before_bulk(self):
+        pool = self.make_pool()
+        self.block()
+        for i in xrange(3):
+            pool.submit('x%d' % i, self.record, 'x%d' % i, bulk=True)
+        pool.submit('e', self.record, 'e')
+        # priority still goes before bulk
+        pool.submit('p', self.record, 'p', priority=1, bulk=True)
+        self.assertEqual(self.run_all(), ['p', 'e', 'x0', 'x1', 'x2'])
+
+    def test_key_ranks_as_its_most_urgent_task(self):
+        pool = self.make_pool()
+        self.block()
+        pool.submit('x', self.record, 'x1', bulk=True)
+        pool.submit('y', self.record, 'y', bulk=True)
+        pool.submit('x', self.record, 'x2')
+        # the tasks of one key still run in submission order
+        self.assertEqual(self.run_all(), ['x1', 'x2', 'y'])
+
+    def test_tasks_of_a_key_do_not_overtake_each_other(self):
+        pool = self.make_pool(workers=3)
+        self.block('k')
+        pool.submit('k', self.record, 'k1')
+        pool.submit('k', self.record, 'k2', priority=5)
+        self.assertEqual(self.run_all(), ['k1', 'k2'])
+
+    def test_group_limit(self):
+        pool = self.make_pool(workers=4)
+        lock = threading.Lock()
+        counts = {'running': 0, 'peak': 0}
+
+        def func(name):
+            with lock:
+                counts['running'] += 1
+                counts['peak'] = max(counts['peak'], counts['running'])
+            time.sleep(0.02)
+            with lock:
+                counts['running'] -= 1
+            self.record(name)
+
+        for i in xrange(8):
+            pool.submit('g%d' % i, func, 'g%d' % i, group='g', limit=2)
+        self.assertTrue(pool.depth()['groups']['g']['running'] <= 2)
+        # a task of another group is not held back by them
+        pool.submit('o', self.record, 'o')
+        done = self.run_all()
+        self.assertEqual(counts['peak'], 2)
+        self.assertEqual(sorted(done), ['g%d' % i for i in xrange(8)] + ['o'])
+        self.assertTrue(done.index('o') < 4, done)
+        self.assertEqual(pool.depth()['groups'], {})
+
+    def test_cancel_replaces_pending_task(self):
+        pool = self.make_pool(supersede='cancel')
+        self.block()
+        pool.submit_latest('k', self.record, 'k1')
+        pool.submit_latest('k', self.record, 'k2')
+        pool.submit_latest('j', self.record, 'j')
+        self.assertEqual(pool.depth()['pending'], 2)
+        self.assertEqual(self.run_all(), ['k2', 'j'])
+        self.assertEqual(pool.superseded, 1)
+
+    def test_cancel_drops_rank_of_replaced_task(self):
+        pool = self.make_pool(supersede='cancel')
+        self.block()
+        pool.submit_latest('k', self.record, 'k1', priority=5)
+        pool.submit_latest('j', self.record, 'j', priority=1)
+        pool.submit_latest('k', self.record, 'k2')
+        self.assertEqual(self.run_all(), ['j', 'k2'])
+
+    def test_cancel_running_task(self):
+        pool = self.make_pool(supersede='cancel')
+        cancelled = []
+        started = threading.Event()
+
+        def func():
+            started.set()
+            self.gate.wait()
+            cancelled.append(current_task().cancelled)
+        pool.submit_latest('k', func)
+        started.wait()
+        pool.submit_latest('k', self.record, 'k2')
+        self.assertEqual(self.run_all(), ['k2'])
+        self.assertEqual(cancelled, [True])
+
+    def test_ignore_keeps_queued_task(self):
+        pool = self.make_pool(supersede='ignore')
+        self.block()
+        pool.submit_latest('k', self.record, 'k1', bulk=True)
+        pool.submit_latest('k', self.record, 'k2')
+        pool.submit_latest('j', self.record, 'j', bulk=True)
+        self.assertEqual(self.run_all(), ['k1', 'j'])
+        self.assertEqual(pool.superseded, 1)
+
+
+class BurstTest(unittest.TestCase):
+    def test_changes_are_counted_over_the_window(self):
+        drag = Dragline(workers=0, burst=10)
+        self.assertFalse(drag._is_bulk(4, 100))
+        self.assertFalse(drag._is_bulk(4, 100.2))
+        # a checkout reported over several polls
+        self.assertTrue(drag._is_bulk(4, 100.4))
+        self.assertTrue(drag._is_bulk(1, 100.8))
+        # an edit once it is over
+        self.assertFalse(drag._is_bulk(1, 100.4 + BURST_WINDOW))
+
+    def test_single_large_set(self):
+        drag = Dragline(workers=0, burst=10)
+        self.assertTrue(drag._is_bulk(10, 100))
+        self.assertFalse(drag._is_bulk(1, 100 + BURST_WINDOW))
+
+    def test_disabled(self):
+        drag = Dragline(workers=0, burst=0)
+        self.assertFalse(drag._is_bulk(1000, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
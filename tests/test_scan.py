@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import dragline.scanner
+from dragline.core import Dragline
+
+
+class ScanTest(unittest.TestCase):
+    # the module's scandir, or None for the listdir fallback
+    scandir = None
+
+    def setUp(self):
+        self.scandir_saved = dragline.scanner.scandir
+        dragline.scanner.scandir = self.scandir
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp(prefix='dragline-test-')
+        os.chdir(self.root)
+
+    def tearDown(self):
+        dragline.scanner.scandir = self.scandir_saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, path, size):
+        dirpath = os.path.dirname(path)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        f = open(path, 'w')
+        f.write('x' * size)
+        f.close()
+
+    def test_ignored_file_does_not_shift_stats(self):
+        # the ignored file sorts before the watched ones of its directory
+        self.write('d/a.log', 100)
+        self.write('d/b.txt', 7)
+        self.write('d/c.txt', 9)
+        drag = Dragline(ignores=['*.log'], workers=0)
+        stats = dict((path, size) for path, mtime, size in drag.iter_stats())
+        self.assertEqual(stats, {'d/b.txt': 7, 'd/c.txt': 9})
+
+    def test_modification_after_ignored_file(self):
+        self.write('d/a.log', 100)
+        self.write('d/b.txt', 7)
+        self.write('d/c.txt', 9)
+        drag = Dragline(ignores=['*.log'], workers=0)
+        drag.last_record = drag.get_record()
+        os.utime('d/c.txt', (1, 1))
+        changes, changes_list = drag.get_changes()
+        self.assertEqual(changes_list, ['d/c.txt'])
+
+
+@unittest.skipIf(dragline.scanner.scandir is None, 'scandir is not available')
+class ScandirScanTest(ScanTest):
+    # the DirEntry of each file is reused for its stat
+    scandir = staticmethod(dragline.scanner.scandir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dragline.core import Dragline
+from dragline.handlers import ActionHandler
+
+
+calls = []
+
+
+class BatchHandler(ActionHandler):
+    batch = True
+
+    def added_batch(self, filepaths):
+        calls.append(('added', sorted(filepaths)))
+
+    def modified_batch(self, filepaths):
+        calls.append(('modified', sorted(filepaths)))
+
+    def removed_batch(self, filepaths):
+        calls.append(('removed', sorted(filepaths)))
+
+
+class TriggerBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp(prefix='dragline-test-')
+        os.chdir(self.root)
+        for i in ('_m.styl', 'a.styl'):
+            open(i, 'w').close()
+        del calls[:]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def trigger(self, action, workers):
+        drag = Dragline(handlers=[('*.styl', BatchHandler)], workers=workers)
+        drag.depgraph.set_dependencies('a.styl', ['_m.styl'])
+        drag.trigger(action, '_m.styl')
+        return sorted(calls)
+
+    def test_dependents_are_batched_as_modified(self):
+        for workers in (0, 2):
+            del calls[:]
+            self.assertEqual(self.trigger('-', workers),
+                             [('modified', ['a.styl']), ('removed', ['_m.styl'])])
+            del calls[:]
+            self.assertEqual(self.trigger('+', workers),
+                             [('added', ['_m.styl']), ('modified', ['a.styl'])])
+
+
+if __name__ == '__main__':
+    unittest.main()